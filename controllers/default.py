@@ -36,31 +36,13 @@ def bird():
 #
 def knowledge():
 
-    #   make sure the global ROOT concept exists; this is the root of the tree of all concepts
-    db.concept.update_or_insert(db.concept.name == 'ROOT',
-        name = 'ROOT', description = 'root of the concept tree')
-    db.concept.update_or_insert(db.concept.name == 'in',
-        name = 'in', description = 'one concept belongs within another')
-    db.concept.update_or_insert(db.concept.name == 'is a',
-        name = 'is a', description = 'one concept is an instance of another')
-
-    rootId = db(db.concept.name == 'ROOT').select().first().id
-    inId = db(db.concept.name == 'in').select().first().id
-    isAId = db(db.concept.name == 'is a').select().first().id
-
-    db.part.update_or_insert(db.part.concept == rootId,
-        concept = rootId)
-
-    rootNode = db(db.part.concept == rootId).select().first().id
-
-    db.part.update_or_insert((db.part.concept == inId) & (db.part.end == rootNode),
-        concept = inId, end = rootNode)
-    db.part.update_or_insert((db.part.concept == isAId) & (db.part.end == rootNode),
-        concept = isAId, end = rootNode)
-
-    #   There are no URL options for the main page and knowledge.html handles everything so we just
-    #   return an empty Python dictionary
-    return dict()
+    #   The ROOT concept and the other records the page needs are created once, by
+    #   /cron/bootstrap.py, so here we only need the id of the ROOT part, which is cached
+    from graph_bootstrap import wellKnownIds
+    rootPart = wellKnownIds(db, cache)['root part']
+
+    #   There are no URL options for the main page and knowledge.html handles everything else
+    return dict(rootPart=rootPart or 1)
 
 
 def description():
@@ -74,106 +56,274 @@ def description():
 
 def load():
 
-    import json, urllib
-    body = request.body.read()
-    body = urllib.unquote(body).decode('utf8')
-    request_vars = json.loads(body)
-
-    records = {'concept': {}, 'part': {}}
-
-    loadPart(1, records)
-
-    return response.json(records)
-
-
-def loadPart(partId, records):
-
-    if partId in records['part']:
-        return
-
-    part = db.part(partId)
-    records['part'][partId] = part.as_dict()
-
-    loadConcept(part.concept, records)
-    if part.start is not None:
-        loadPart(part.start, records)
-    if part.end is not None:
-        loadPart(part.end, records)
-    for part in db((db.part.start == partId) | (db.part.end == partId)).iterselect():
-        loadPart(part.id, records)
-
-
-def loadConcept(conceptId, records):
-
-    if conceptId in records['concept']:
-        return
-
-    concept = db.concept(conceptId)
-    records['concept'][conceptId] = concept.as_dict()
-
-
-def save():
+    #   a plain GET loads the whole graph, or the neighborhood of a part, in a form browsers and
+    #   proxies can cache
+    if request.env.request_method == 'GET':
+        return loadCacheable(request.vars)
 
     import json, urllib
     body = request.body.read()
     body = urllib.unquote(body).decode('utf8')
     request_vars = json.loads(body)
-    records = request_vars['records']
-
-    print('SAVING RECORDS')
-    print('{}'.format(records))
 
-    records['saved'] = {'concept': {}, 'part': {}}
+    #   a client that already has the graph as of some version can ask for just what changed since
+    since = request_vars.get('since')
+    if since is not None:
+        if not (isint(since) and int(since) >= 0):
+            raise HTTP(400, 'invalid load options')
+        from graph_changes import loadChanges
+        return jsonRecords(request_vars, loadChanges(db, int(since)))
+
+    #   the client can ask for just the neighborhood of a part - up to 'depth' hops out and about
+    #   'limit' parts - and page through the rest by sending back the 'cursor' it gets
+    root, depth, limit = loadOptions(request_vars)
+    cursor = request_vars.get('cursor')
+
+    #   read the version before the graph, so anything saved while we load is newer than what we report
+    from graph_changes import currentVersion
+    version = currentVersion(db)
+
+    #   traversals are served from the in-memory part index unless the client asks for one of the
+    #   database engines: 'recursive' computes the reachable graph in one recursive query, and 'bfs'
+    #   goes level by level (it's also the fallback for backends without recursive queries)
+    from graph_load import loadGraph, loadGraphRecursive, loadNeighborhood, iterReachableParts, streamGraph
+    from graph_format import isColumnar
+    from graph_index import partIndex
+    engine = request_vars.get('engine', 'index')
+    index = partIndex(db, cache) if engine == 'index' else None
+
+    if depth is not None or limit is not None or cursor:
+        try:
+            records = loadNeighborhood(db, [root], depth=depth, limit=limit, cursor=cursor, index=index)
+        except ValueError:
+            raise HTTP(400, 'invalid cursor')
+
+    #   otherwise we load everything reachable from the root.  If the client asks for a stream, we
+    #   only work out which parts to send here, and write the JSON out as we read the rows
+    elif request_vars.get('stream'):
+        if index is not None:
+            parts = index.snapshot([root])
+        else:
+            parts = iterReachableParts(db, [root])
+        response.headers['Content-Type'] = 'application/json'
+        return streamFromDatabase(streamGraph(db, parts, extra={'version': version},
+            columnar=isColumnar(request_vars)))
+    elif engine == 'index':
+        records = index.load(db, [root])
+    elif engine == 'bfs':
+        records = loadGraph(db, [root])
+    else:
+        records = loadGraphRecursive(db, [root])
 
-    for cid in records['concept']:
-        saveRecord(records, 'concept', cid)
-    for pid in records['part']:
-        saveRecord(records, 'part', pid)
+    records['version'] = version
+    return jsonRecords(request_vars, records)
 
-    db.executesql('alter table concept auto_increment=1')
-    db.executesql('alter table part auto_increment=1')
 
-    for table in records['saved']:
-        for rid in records['saved'][table]:
-            rid = str(rid)
-            newId = str(records['saved'][table][rid])
-            if newId != rid:
-                records[table][newId] = records[table][rid]
-                del records[table][rid]
+#   loadOptions:
+#   The root, depth and limit of a load (see 'load' above), the last two None if not given.
+#
+def loadOptions(request_vars):
+    root = requestedRoot(request_vars)
+    depth = request_vars.get('depth')
+    limit = request_vars.get('limit')
+    if not positive(root) or (depth is not None and not (isint(depth) and int(depth) >= 0)) \
+            or (limit is not None and not positive(limit)):
+        raise HTTP(400, 'invalid load options')
+    return int(root), None if depth is None else int(depth), None if limit is None else int(limit)
+
+
+#   loadCacheable:
+#   Most loads return exactly what the last one did, so for GET requests we tag the response with
+#   the graph version (bumped by every save) and what was asked for as its ETag, and answer 304 Not
+#   Modified if the client already has that.  The serialized response for the current version is
+#   kept in cache.ram, so however many readers load the same version, we only build it once per
+#   process.  Only the loads from the ROOT part, which is where every page starts, are kept, one
+#   per database and format: the client can ask for any root, depth and limit, and keeping one
+#   response for each would let the cache grow without bound.
+#
+def loadCacheable(request_vars):
+
+    from graph_changes import currentVersion
+    from graph_format import isColumnar, toColumnar
+    from graph_index import partIndex
+    from graph_load import loadNeighborhood
+
+    root, depth, limit = loadOptions(request_vars)
+    columnar = isColumnar(request_vars)
+    shape = '%d-%s-%s%s' % (root, 'all' if depth is None else depth, 'all' if limit is None else limit,
+        '-columnar' if columnar else '')
+
+    version = currentVersion(db)
+    etag = '"graph-%d-%s"' % (version, shape)
+    headers = {'ETag': etag, 'Cache-Control': 'public, no-cache', 'Content-Type': 'application/json'}
+    for header in ('Pragma', 'Expires'):
+        response.headers.pop(header, None)
+
+    clientTags = [tag.strip() for tag in (request.env.http_if_none_match or '').split(',')]
+    if etag in clientTags or 'W/' + etag in clientTags or '*' in clientTags:
+        raise HTTP(304, '', **headers)
+
+    def build():
+        index = partIndex(db, cache)
+        if depth is not None or limit is not None:
+            records = loadNeighborhood(db, [root], depth=depth, limit=limit, index=index)
+        else:
+            records = index.load(db, [root])
+        records['version'] = version
+        if columnar:
+            records = toColumnar(records)
+        return version, shape, response.json(records)
+
+    response.headers.update(headers)
+    if root != int(requestedRoot({})):
+        return build()[2]
+
+    key = 'graph_payload_%s%s' % (db._uri_hash, '_columnar' if columnar else '')
+    cached = cache.ram(key, build, time_expire=None)
+    if cached[:2] != (version, shape):
+        cache.ram(key, None)
+        cached = cache.ram(key, build, time_expire=None)
+    return cached[2]
+
+
+#   requestedRoot:
+#   The part a load starts from: the ROOT part unless the client says otherwise.
+#
+def requestedRoot(request_vars):
+    from graph_bootstrap import wellKnownIds
+    return request_vars.get('root') or wellKnownIds(db, cache)['root part'] or 1
 
-    del records['saved']
 
+#   jsonRecords:
+#   Respond with the given records, in the columnar format if that's what the client asked for
+#   (see /modules/graph_format.py).
+#
+def jsonRecords(request_vars, records):
+    from graph_format import isColumnar, toColumnar
+    if isColumnar(request_vars):
+        records = toColumnar(records)
     return response.json(records)
 
 
-def saveRecord(records, table, rid):
-
-    rid = str(rid)
-    if rid in records['saved'][table]:
-        return records['saved'][table][rid]
-
-    record = records[table][rid]
+#   streamFromDatabase:
+#   Pass through the chunks of a streamed response.  web2py commits and closes the database
+#   connection before it sends the body, so we reopen it to read the rows, and close it when done.
+#
+def streamFromDatabase(chunks):
+    db._adapter.reconnect()
+    try:
+        for chunk in chunks:
+            yield chunk
+    finally:
+        db._adapter.close()
 
-    if table is 'part':
-        if 'concept' in record and record['concept'] is not None:
-            record['concept'] = saveRecord(records, 'concept', record['concept'])
-        if 'start' in record and record['start'] is not None:
-            record['start'] = saveRecord(records, 'part', record['start'])
-        if 'end' in record and record['end'] is not None:
-            record['end'] = saveRecord(records, 'part', record['end'])
 
-    if 'deleted' in record:
-        db(db[table].id == record['id']).delete()
-    elif 'id' in record:
-        db[table][record['id']].update_record(**record)
-    else:
-        record['id'] = db[table].insert(**record)
-
-    if str(record['id']) != str(rid):
-        record['oldId'] = rid
+def save():
 
-    records['saved'][table][rid] = str(record['id'])
-    return record['id']
+    #   the body is parsed as it's read, so we never hold more than a chunk of it at once; the records
+    #   come out in the usual format, even if they were sent as columns
+    from graph_request import readSaveRequest
+    try:
+        request_vars = readSaveRequest(request.body)
+    except ValueError:
+        raise HTTP(400, 'invalid save request')
+    records = request_vars.get('records')
+    if not isinstance(records, dict):
+        raise HTTP(400, 'invalid save request')
+
+    #   if this save was already done - the client sent it again because it didn't hear back - just
+    #   send the same response (see /modules/graph_save.py)
+    from graph_save import saveGraph, SaveError, SaveConflict, SaveInProgress, claimRequest, recordResponse
+    key = request.env.http_idempotency_key
+    if key:
+        #   the first save with this key hasn't finished yet: the client sends it again after a while
+        try:
+            saved = claimRequest(db, key)
+        except SaveInProgress as e:
+            raise HTTP(503, str(e), **{'Retry-After': '2'})
+        if saved is not None:
+            response.headers['Content-Type'] = 'application/json'
+            return saved
+
+    def respond(body):
+        if key:
+            recordResponse(db, key, body)
+        return body
+
+    #   a big import can take longer than the web server will wait, so the client can ask for the
+    #   save to be done by a background worker instead (see /models/scheduler.py), and check on it
+    #   through save_status
+    from app_setup import wrote
+    if request_vars.get('async'):
+        job = scheduler.queue_task('save_graph', pvars={'records': records},
+            timeout=SAVE_JOB_TIMEOUT, sync_output=2)
+        if job.errors:
+            db.rollback()
+            raise HTTP(500, 'could not queue the save')
+        wrote(session)
+        return respond(response.json({'job': job.id}))
+
+    #   the whole save is one transaction, and if anything goes wrong it's rolled back, version bump
+    #   and all.  This session's loads then go to the primary database for a while, until the
+    #   replica has the save (see /modules/app_setup.py)
+    from graph_index import partIndex
+    try:
+        records = saveGraph(db, records)
+    except SaveError as e:
+        raise HTTP(400, str(e))
+
+    #   someone else saved some of these records first: write nothing, and send back the current
+    #   version of just those records so the client can catch up on them
+    except SaveConflict as e:
+        raise HTTP(409, response.json(e.conflicts), **{'Content-Type': 'application/json'})
+
+    wrote(session)
+    version, parts = records['version'], list(records['part'].values())
+    body = respond(jsonRecords(request_vars, records))
+
+    #   only once the save is committed can this process's part index have it, or a load in the
+    #   meantime would find the index ahead of the database
+    db.commit()
+    partIndex(db, cache, sync=False).patch(version, parts)
+    return body
+
+
+#   save_status:
+#   How a background save is going.  'status' is the scheduler's: QUEUED, ASSIGNED, RUNNING, then
+#   COMPLETED, or FAILED or TIMEOUT if it didn't work out.  While it runs, 'progress' says which
+#   stage it's reached; once completed, 'result' is what the save handler would have returned.
+#
+def save_status():
+
+    job = request.vars.job
+    if not positive(job):
+        raise HTTP(400, 'invalid job')
+    task = scheduler.task_status(int(job), output=True)
+    if task is None:
+        raise HTTP(404, 'no such job')
+
+    status = {'job': int(job), 'status': task.scheduler_task.status}
+    if task.scheduler_run:
+        status['progress'] = (task.scheduler_run.run_output or '').strip()
+    if task.scheduler_task.status == 'COMPLETED':
+        status['result'] = task.result
+
+        #   the save has only just been written, so this session's loads go to the primary for a
+        #   while, as after a save done in the request (see /modules/app_setup.py)
+        from app_setup import wrote
+        wrote(session)
+    return response.json(status)
+
+
+#   pool_stats:
+#   The connection pool counters of this process (see /modules/db_pool.py), for sizing the pools.
+#   Only served to requests from the server itself.
+#
+def pool_stats():
+    if not request.is_local:
+        raise HTTP(403, 'not authorized')
+    from db_pool import poolStats
+    return response.json(poolStats())
 
 
 def isint(val):
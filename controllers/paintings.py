@@ -18,50 +18,36 @@ def about():
 
 def paintings():
 
-    import datetime
+    from painting_catalog import findPaintings
 
-    records = []
     filters = {}
-    match = {}
 
-    if 'year' in request.vars:
+    year = request.vars['year'] if 'year' in request.vars else request.args(0)
+    if year:
         try:
-            filters['year'] = int(request.vars['year'])
+            filters['year'] = int(year)
         except ValueError:
             pass
-    elif len(request.args) > 0:
-        filters['year'] = int(request.args(0))
     if 'text' in request.vars and request.vars['text'] is not None and len(request.vars['text']) > 0:
         filters['text'] = request.vars['text'].lower()
 
-    date_fields = ['start_date', 'end_date']
-    years = {}
+    try:
+        page = max(1, int(request.vars['page'] or 1))
+    except ValueError:
+        page = 1
 
-    for painting in db(db.painting).iterselect(orderby=db.painting.end_date|db.painting.start_date):
+    try:
+        records, more = findPaintings(db, filters.get('year'), filters.get('text'), page)
+    except ValueError:
+        #   not a year any date can have
+        records, more = [], False
 
-        for field in date_fields:
-            if painting[field] is not None:
-                year = painting[field].year
-                years[year] = True
-                if 'year' in filters and year == filters['year']:
-                        match['year'] = True
-
-        if 'text' in filters:
-            for field in painting:
-                if isinstance(painting[field], str) and filters['text'] in painting[field].lower():
-                    match['text'] = True
-
-        full_match = True
-        for key in filters:
-            if key not in match or not match[key]:
-                full_match = False
-                break
-        if full_match:
-            records.append(painting)
+    #   the years, with their counts, that /models/menu.py loaded for the year menu
+    years = [OPTION('%d (%d)' % (year, count), _value=year) for year, count in paintingYearCounts]
 
     filter_form = FORM(
         DIV(LABEL('Year', _for='year'),
-            SELECT('', *years.keys(), _name='year', value=str(filters['year']) if 'year' in filters else '', _class='form-control'),
+            SELECT('', *years, _name='year', value=str(filters['year']) if 'year' in filters else '', _class='form-control'),
             _class='form-group'),
         DIV(LABEL('Search Text', _for='text'),
             INPUT(_name='text', _placeholder='Search text...', _value=filters['text'] if 'text' in filters else '', _class='form-control',
@@ -78,7 +64,13 @@ def paintings():
 
     is_filtered = 'year' in filters or 'text' in filters
 
-    return dict(paintings=records, form=filter_form, filtered=is_filtered)
+    pageVars = dict((key, value) for key, value in (('year', filters.get('year')),
+        ('text', request.vars['text'])) if value)
+    previous = URL('paintings', 'paintings', vars=dict(pageVars, page=page - 1)) if page > 1 else None
+    following = URL('paintings', 'paintings', vars=dict(pageVars, page=page + 1)) if more else None
+
+    return dict(paintings=records, form=filter_form, filtered=is_filtered,
+        previous=previous, following=following)
 
 
 def painting():
@@ -87,11 +79,23 @@ def painting():
 
 
 def painting_update():
+    from painting_catalog import syncPainting, recordYears, refreshYears
+    from painting_images import removeThumbnails, queueThumbnails
     record = db.painting(request.args(0))
     is_update = record is not None
+    years = recordYears(record)
     form = SQLFORM(db.painting, record, deletable=True,
                   upload=URL('painting_download'))
     if form.process().accepted:
+        syncPainting(db, form.vars.id or record.id)
+        updated = db.painting(form.vars.id or record.id)
+        refreshYears(db, years | recordYears(updated))
+        if record and record.image and (updated is None or updated.image != record.image):
+            removeThumbnails(request.folder, record.image)
+        if updated and updated.image and (record is None or updated.image != record.image):
+            queueThumbnails(request.folder, db.painting.image.uploadfolder, updated.image,
+                myconf.get('images.workers'), myconf.get('images.queue_size'))
+        app_setup.wrote(session)
         if is_update:
             session.flash = 'Painting updated'
         redirect(URL('paintings', 'painting/' + str(form.vars.id)))
@@ -102,8 +106,28 @@ def painting_update():
 def painting_download():
     return response.download(request, db)
 
+#   image.jpg/<width>/<upload name>: a smaller copy of an uploaded image (see
+#   /modules/painting_images.py), which never changes once made, so browsers can keep it
+def image():
+    from painting_images import thumbnail
+    path = thumbnail(request.folder, db.painting.image.uploadfolder, request.args(1), request.args(0))
+    if path is None:
+        raise HTTP(404)
+    response.headers['Content-Type'] = 'image/jpeg'
+    response.headers['Cache-Control'] = 'public, max-age=31536000'
+    return response.stream(path, request=request)
+
+#   image_status/<upload name>: whether the smaller copies of a new upload have been made yet, as
+#   JSON {'status': 'pending', 'done', 'failed' or 'unknown'}
+def image_status():
+    from painting_images import thumbnailStatus
+    return response.json({'status': thumbnailStatus(request.args(0))})
+
 def painting_delete():
 
+    from painting_catalog import syncPainting, recordYears, refreshYears
+    from painting_images import removeThumbnails
+
     record = db.painting(request.args(0))
 
     year = None
@@ -113,6 +137,11 @@ def painting_delete():
         year = record.end_date.year
 
     record.delete_record()
+    syncPainting(db, record.id)
+    refreshYears(db, recordYears(record))
+    if record.image:
+        removeThumbnails(request.folder, record.image)
+    app_setup.wrote(session)
 
     session.flash = 'Painting removed'
     if 'from_record' in request.vars and request.vars['from_record']:
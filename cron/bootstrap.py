@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+
+#
+#   Creates the records every concept graph starts with (see /modules/graph_bootstrap.py), and the
+#   indexes of its tables (see /modules/db_indexes.py), if they don't exist yet.  Run by web2py cron
+#   when the site starts (see /cron/crontab), or by hand with
+#
+#       python web2py.py -S welcome/default -M -R applications/welcome/cron/bootstrap.py
+#
+
+from db_indexes import ensureIndexes
+from graph_bootstrap import bootstrap
+
+ensureIndexes(db)
+bootstrap(db)
+db.commit()
@@ -18,35 +18,19 @@ if request.global_settings.web2py_version < "2.14.1":
 
 # -------------------------------------------------------------------------
 # app configuration made easy. Look inside private/appconfig.ini
+#
+# The config and database location are read once per process, and tables
+# are defined lazily - see /modules/app_setup.py
 # -------------------------------------------------------------------------
-from gluon.contrib.appconfig import AppConfig
-
-import os
-import gluon.fileutils
+import app_setup
 
-# -------------------------------------------------------------------------
-# once in production, remove reload=True to gain full speed
-# -------------------------------------------------------------------------
-myconf = AppConfig(reload=True)
+myconf = app_setup.settings(request.folder)['config']
 
 if not request.env.web2py_runtime_gae:
     # ---------------------------------------------------------------------
     # if NOT running on Google App Engine use SQLite or other DB
     # ---------------------------------------------------------------------
-
-    if request.controller == 'paintings':
-        db_name = 'paintings'
-    else:
-        db_name = 'concept_graph'
-
-    miscFile = os.path.join(request.folder, 'static/misc.txt')
-    lines = gluon.fileutils.readlines_file(miscFile)
-    db = DAL(lines[0] + db_name)
-
-    #db = DAL(myconf.get('db.uri'),
-    #         pool_size=myconf.get('db.pool_size'),
-    #         migrate_enabled=myconf.get('db.migrate'),
-    #         check_reserved=['all'])
+    db = app_setup.connect(request, session)
 else:
     # ---------------------------------------------------------------------
     # connect to Google BigTable (optional 'google:datastore://namespace')
@@ -97,34 +81,40 @@ response.form_label_separator = myconf.get('forms.separator') or ''
 
 from gluon.tools import Auth, Service, PluginManager
 
-# host names must be a list of allowed host names (glob syntax allowed)
-auth = Auth(db, host_names=myconf.get('host.names'))
 service = Service()
 plugins = PluginManager()
 
 # -------------------------------------------------------------------------
-# create all tables needed by auth if not custom tables
+# auth is only set up for the pages that use it (see app_setup.needsAuth);
+# the JSON handlers don't need it
 # -------------------------------------------------------------------------
-auth.define_tables(username=False, signature=False)
+if app_setup.needsAuth(request):
+    # host names must be a list of allowed host names (glob syntax allowed)
+    auth = Auth(db, host_names=myconf.get('host.names'))
 
-# -------------------------------------------------------------------------
-# configure email
-# -------------------------------------------------------------------------
-mail = auth.settings.mailer
-mail.settings.server = 'logging' if request.is_local else myconf.get('smtp.server')
-mail.settings.sender = myconf.get('smtp.sender')
-mail.settings.login = myconf.get('smtp.login')
-mail.settings.tls = myconf.get('smtp.tls') or False
-mail.settings.ssl = myconf.get('smtp.ssl') or False
+    # -------------------------------------------------------------------------
+    # create all tables needed by auth if not custom tables
+    # -------------------------------------------------------------------------
+    auth.define_tables(username=False, signature=False)
 
-# -------------------------------------------------------------------------
-# configure auth policy
-# -------------------------------------------------------------------------
-auth.settings.registration_requires_verification = False
-auth.settings.registration_requires_approval = False
-auth.settings.reset_password_requires_verification = True
+    # -------------------------------------------------------------------------
+    # configure email
+    # -------------------------------------------------------------------------
+    mail = auth.settings.mailer
+    mail.settings.server = 'logging' if request.is_local else myconf.get('smtp.server')
+    mail.settings.sender = myconf.get('smtp.sender')
+    mail.settings.login = myconf.get('smtp.login')
+    mail.settings.tls = myconf.get('smtp.tls') or False
+    mail.settings.ssl = myconf.get('smtp.ssl') or False
 
-auth.settings.actions_disabled.append('register')
+    # -------------------------------------------------------------------------
+    # configure auth policy
+    # -------------------------------------------------------------------------
+    auth.settings.registration_requires_verification = False
+    auth.settings.registration_requires_approval = False
+    auth.settings.reset_password_requires_verification = True
+
+    auth.settings.actions_disabled.append('register')
 
 # -------------------------------------------------------------------------
 # Define your tables below (or better in another model file) for example
@@ -154,12 +144,44 @@ if request.controller == 'default':
     db.define_table('concept',
         Field('name', 'string'),
         Field('description', 'string'),
-        Field('commands', 'string'))
+        Field('commands', 'string'),
+        Field('revision', 'integer', default=1))
+
+    #   the indexes of these tables, eg. on part.start and part.end for loading the graph, are in
+    #   /modules/db_indexes.py, and created by /cron/bootstrap.py
 
+    #   'revision' counts the saves of each concept and part, so a save can tell whether the client
+    #   was looking at the latest version of what it's changing - see /modules/graph_save.py
     db.define_table('part',
         Field('concept', db.concept),
         Field('start', 'reference part'),
-        Field('end', 'reference part'))
+        Field('end', 'reference part'),
+        Field('revision', 'integer', default=1))
+
+    #   the graph version and the log of which records each version changed, so clients can load
+    #   just the changes since their last load - see /modules/graph_changes.py
+    db.define_table('graph_version',
+        Field('version', 'integer'))
+
+    db.define_table('graph_change',
+        Field('version', 'integer'),
+        Field('table_name', 'string'),
+        Field('record_id', 'integer'),
+        Field('deleted', 'boolean', default=False))
+
+    #   the next free id of each graph table; saves take ids from here in blocks, rather than
+    #   inserting new records one by one to get their auto-increment ids - see /modules/graph_save.py.
+    #   There's one row per table, made by /modules/graph_bootstrap.py
+    db.define_table('graph_sequence',
+        Field('table_name', 'string', unique=True),
+        Field('next_id', 'integer'))
+
+    #   the responses to recent saves, by the idempotency key the client sent with them, so a save
+    #   that's sent again (eg. after a timeout) isn't done twice
+    db.define_table('save_request',
+        Field('request_key', 'string', length=128, unique=True),
+        Field('response', 'text'),
+        Field('created_on', 'datetime'))
 
 elif request.controller == 'paintings':
     import os
@@ -178,6 +200,19 @@ elif request.controller == 'paintings':
         Field('width_inches', 'integer'),
         Field('height_inches', 'integer'))
 
+    #   how many paintings each year has, for the year menu and filter - see /modules/painting_catalog.py
+    db.define_table('painting_year',
+        Field('year', 'integer', unique=True),
+        Field('paintings', 'integer'))
+
+    #   the gallery's filters and order use the indexes on the dates, and its text search a full-text
+    #   index (see /modules/painting_catalog.py)
+    if not app_setup.useReplica(request, session):
+        import db_indexes, painting_catalog
+        db_indexes.ensureIndexesOnce(db)
+        painting_catalog.ensureSearchIndex(db)
+        painting_catalog.ensureYearFacet(db)
+
 # -------------------------------------------------------------------------
 # after defining tables, uncomment below to enable auditing
 # -------------------------------------------------------------------------
@@ -32,14 +32,11 @@ response.menu = [
     (T('Home'), False, URL(request.controller, 'index'), [])
 ]
 
-if request.controller == 'paintings':
-    years = {}
-    for painting in db(db.painting).iterselect(db.painting.start_date, db.painting.end_date):
-        if painting.start_date is not None:
-            years[painting.start_date.year] = True
-        if painting.end_date is not None:
-            years[painting.end_date.year] = True
-    yearMenu = [['All', False, URL('paintings','paintings')]] + [[str(year), False, URL('paintings', 'paintings/'+str(year))] for year in years]
+#   only the HTML pages show the menu, so the images and JSON handlers don't query the year facet
+if request.controller == 'paintings' and request.extension == 'html':
+    from painting_catalog import yearFacet
+    paintingYearCounts = yearFacet(db)
+    yearMenu = [['All', False, URL('paintings','paintings')]] + [['%d (%d)' % (year, count), False, URL('paintings', 'paintings/'+str(year))] for year, count in paintingYearCounts]
     response.menu += [
         ['About Me', False, URL('paintings', 'about')],
         ['Paintings', False, URL('paintings', 'paintings'), yearMenu]
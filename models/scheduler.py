@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+#
+#   BACKGROUND JOBS
+#
+#   Saves that are too big to do within a web request (see the 'save' handler in
+#   /controllers/default.py) are queued as tasks for the web2py scheduler, which keeps them in
+#   the concept graph database.  The tasks are run by a separate worker process, started with
+#
+#       python web2py.py -K welcome
+#
+#   from the web2py folder, kept running alongside the web server (eg. as an always-on task, or
+#   from an @reboot line in /cron/crontab).  Without a worker, queued saves just wait.
+#   http://web2py.com/books/default/chapter/29/04/the-core#web2py-Scheduler
+#
+
+if request.controller == 'default':
+    import sys
+    from gluon.scheduler import Scheduler
+
+    #   seconds a background save can run before the scheduler gives up on it
+    SAVE_JOB_TIMEOUT = 3600
+
+    #   saveGraphJob:
+    #   Save the records in the background.  The result is what the 'save' handler would have
+    #   responded with; if the save can't be done, it's {'error': message} or, if some records were
+    #   changed by someone else first, {'conflicts': records}.  Progress goes to the task output,
+    #   where save_status can pick it up.
+    #
+    def saveGraphJob(records):
+        from graph_save import saveGraph, SaveError, SaveConflict
+
+        def progress(message):
+            sys.stdout.write('!clear!%s\n' % message)
+            sys.stdout.flush()
+
+        try:
+            saved = saveGraph(db, records, progress=progress)
+        except SaveError as e:
+            return {'error': str(e)}
+        except SaveConflict as e:
+            return {'conflicts': e.conflicts}
+        db.commit()
+        return saved
+
+    #   only the handlers that queue or look up background saves need the scheduler, and the worker
+    #   process, which runs outside of any HTTP request - not the loads, which come all the time
+    if request.function in ('save', 'save_status') or request.is_scheduler \
+            or not request.env.request_method:
+        scheduler = Scheduler(db, tasks={'save_graph': saveGraphJob})
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+#
+#   app_setup.py
+#
+#   The setup that /models/db.py needs on every request, done as cheaply as possible.  The app
+#   config (/private/appconfig.ini) and the database location (the first line of /static/misc.txt)
+#   are read once per process instead of once per request.  Tables are defined lazily, so a request
+#   only pays for the tables it uses, and connections come from a pool for each database (see
+#   db_pool.py).
+#
+#   Authentication is only set up for the requests that use it (see needsAuth): the JSON handlers
+#   that the concept graph page calls all the time don't need it.
+#
+#   If the app config names a read replica (db.replica, a URI prefix like the one in misc.txt),
+#   the handlers that only read from the database get the replica instead of the primary - unless
+#   the same session wrote something in the last db.replica_window seconds, since the replica may
+#   not have caught up with that yet.
+#
+
+import os
+import time
+
+from gluon.contrib.appconfig import AppConfig
+import gluon.fileutils
+
+import db_pool
+
+
+#   the parsed settings of each app folder (there's only one, but it keeps us honest)
+SETTINGS = {}
+
+
+#   settings:
+#   The app config and database URI prefix for the app in the given folder, read the first time
+#   it's asked for.  The config is the usual AppConfig, eg. settings(folder)['config'].get('db.migrate').
+#
+def settings(folder):
+    if folder not in SETTINGS:
+        lines = gluon.fileutils.readlines_file(os.path.join(folder, 'static', 'misc.txt'))
+        SETTINGS[folder] = {
+            'config': AppConfig(configfile=os.path.join(folder, 'private', 'appconfig.ini'), reload=False),
+            'uri': lines[0].strip(),
+        }
+    return SETTINGS[folder]
+
+
+#   each controller uses one database; the paintings have their own
+def databaseName(controller):
+    return 'paintings' if controller == 'paintings' else 'concept_graph'
+
+
+#   the handlers that never write to the database, as (controller, function)
+READ_ONLY = set([
+    ('default', 'load'),
+    ('paintings', 'paintings'),
+    ('paintings', 'painting'),
+    ('paintings', 'image'),
+])
+
+#   default number of seconds after a session writes that its reads stay on the primary
+REPLICA_WINDOW = 10
+
+
+#   wrote:
+#   Call this from handlers that write, so the session's next reads see what was written.
+#
+def wrote(session):
+    session.wrote_at = time.time()
+
+
+#   useReplica:
+#   Whether this request should read from the replica: it's for a read-only handler, a replica is
+#   configured, and the session hasn't written anything lately.
+#
+def useReplica(request, session):
+    config = settings(request.folder)['config']
+    if not config.get('db.replica') or (request.controller, request.function) not in READ_ONLY:
+        return False
+    window = config.get('db.replica_window')
+    return time.time() - (session.wrote_at or 0) > (REPLICA_WINDOW if window is None else window)
+
+
+#   connect:
+#   The DAL for the given request's database - the replica or the primary, see useReplica - with
+#   lazy tables.  Its connection pool is the size given for that database in the [pools] section of
+#   the app config, or else db.pool_size; idle connections are closed after db.pool_idle_timeout
+#   seconds, and checked before use after db.pool_ping_after seconds.  We never migrate the replica.
+#
+def connect(request, session):
+    config = settings(request.folder)['config']
+    name = databaseName(request.controller)
+    size = config.get('pools.' + name)
+    migrate = config.get('db.migrate')
+    if useReplica(request, session):
+        pool, uri, migrate = name + ' replica', config.get('db.replica') + name, False
+    else:
+        pool, uri = name, settings(request.folder)['uri'] + name
+    return db_pool.connect(pool, uri,
+        int(config.get('db.pool_size') or 0) if size is None else int(size),
+        idleTimeout=config.get('db.pool_idle_timeout') or db_pool.IDLE_TIMEOUT,
+        pingAfter=config.get('db.pool_ping_after') or db_pool.PING_AFTER,
+        migrate_enabled=True if migrate is None else migrate,
+        lazy_tables=True)
+
+
+#   needsAuth:
+#   Whether the request needs the Auth object and its tables: the login pages, the database admin,
+#   and any HTML page (the layout shows the login menu).  Everything else is JSON for scripts.
+#
+def needsAuth(request):
+    return request.function == 'user' or request.controller == 'appadmin' or request.extension == 'html'
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+#
+#   db_indexes.py
+#
+#   The secondary indexes of the app's tables.  The DAL has no way to declare an index along with a
+#   table, so they're listed here by table, and created by ensureIndexes.  /cron/bootstrap.py runs
+#   it on the concept graph database when the site starts; the paintings database has its indexes
+#   made by the first request of each process that uses it (see ensureIndexesOnce).  An index that
+#   already exists is left alone, so it's safe to run any number of times; to add one, add it to
+#   INDEXES and restart.
+#
+#   /private/benchmarks/query_plans.py checks that the queries we run all the time use them.
+#
+
+from sql_helpers import columnName, sqlTable
+
+
+#   table: ((index name, (column, ...)), ...)
+INDEXES = {
+    'concept': (
+        ('concept_name', ('name',)),
+    ),
+    'part': (
+        ('part_concept', ('concept',)),
+        ('part_start', ('start',)),
+        ('part_end', ('end',)),
+    ),
+    'graph_change': (
+        ('graph_change_version', ('version',)),
+    ),
+    'save_request': (
+        ('save_request_created_on', ('created_on',)),
+    ),
+    'painting': (
+        ('painting_end_date', ('end_date', 'start_date')),
+        ('painting_start_date', ('start_date',)),
+    ),
+}
+
+#   uris of the databases whose indexes this process has already made sure of
+ensured = set()
+
+
+#   existingIndexes:
+#   The names of the indexes the given table has, or None if we don't know how to list them on this
+#   kind of database.
+#
+def existingIndexes(db, table):
+    engine = db._adapter.dbengine
+    name = db._adapter.represent(table, 'string')
+    if engine == 'sqlite':
+        sql = "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = %s" % name
+    elif engine == 'mysql':
+        sql = 'SELECT DISTINCT index_name FROM information_schema.statistics' \
+            ' WHERE table_schema = DATABASE() AND table_name = %s' % name
+    elif engine == 'postgres':
+        sql = 'SELECT indexname FROM pg_indexes WHERE tablename = %s' % name
+    else:
+        return None
+    return set(row[0] for row in db.executesql(sql))
+
+
+#   ensureIndexes:
+#   Create whichever of the indexes above are missing, on the tables of the given database, and
+#   return their names.  On databases we can't list the indexes of, we leave them be.  The caller
+#   commits.
+#
+def ensureIndexes(db, indexes=INDEXES):
+    created = []
+    for tablename, tableIndexes in sorted(indexes.items()):
+        if tablename not in db.tables:
+            continue
+        table = db[tablename]
+        existing = existingIndexes(db, table._tablename)
+        if existing is None:
+            return created
+        for name, columns in tableIndexes:
+            if name in existing:
+                continue
+            db.executesql('CREATE INDEX %s ON %s (%s)' % (name, sqlTable(table),
+                ', '.join(columnName(table[column]) for column in columns)))
+            created.append(name)
+    return created
+
+
+#   ensureIndexesOnce:
+#   ensureIndexes, the first time this process sees the given database, and commit.  If another
+#   process is making the same index at the same time, ours fails, and we leave it to them.
+#
+def ensureIndexesOnce(db, indexes=INDEXES):
+    if db._uri in ensured:
+        return
+    try:
+        ensureIndexes(db, indexes)
+        db.commit()
+    except Exception:
+        db.rollback()
+    ensured.add(db._uri)
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+#
+#   db_pool.py
+#
+#   Connection pools for the app's databases, one per logical database ('concept_graph',
+#   'paintings'), each with its own size.  The DAL already keeps a list of spare connections for each
+#   database URI when given a pool_size: a request takes one from the end of the list, or opens a new
+#   one if there are none, and puts it back when done (or closes it, if the list is full).  We swap
+#   that list for a Pool, which also
+#
+#     - closes connections that have sat unused for longer than the idle timeout, rather than
+#       handing the database a connection it may have dropped already,
+#     - checks that a connection still works before handing it out, but only if it's been idle for
+#       a while - the DAL's own check costs a round trip on every request, so we turn that off,
+#     - counts what happens, for poolStats.
+#
+
+import threading
+import time
+
+try:
+    from pydal.connection import ConnectionPool
+except ImportError:
+    from pydal.adapters.base import BaseAdapter as ConnectionPool
+
+from gluon import DAL
+
+
+#   defaults, in seconds, for connections not used in that long: close them, or check them first
+IDLE_TIMEOUT = 300
+PING_AFTER = 30
+
+#   the Pool of each logical database
+POOLS = {}
+
+lock = threading.Lock()
+
+
+def ping(connection):
+    cursor = connection.cursor()
+    try:
+        cursor.execute('SELECT 1')
+        cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def closeQuietly(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+#   Pool:
+#   The DAL's list of spare connections for one database.  The DAL only calls append, pop and len on
+#   it, always holding its global lock, and only pops when the pool isn't empty.  So the connections
+#   that aren't fit to use are weeded out whenever it's asked for its length as well as on pop, and
+#   pop only ever returns one that is.
+#
+class Pool(list):
+
+    def __init__(self, name, size, idleTimeout=IDLE_TIMEOUT, pingAfter=PING_AFTER):
+        list.__init__(self)
+        self.name = name
+        self.size = size
+        self.idleTimeout = idleTimeout
+        self.pingAfter = pingAfter
+        self.returnedAt = {}
+        self.checkedAt = {}
+        self.stats = {'checkouts': 0, 'reused': 0, 'opened': 0, 'returned': 0, 'evicted': 0, 'failed': 0}
+
+    def append(self, connection):
+        self.returnedAt[id(connection)] = time.time()
+        self.stats['returned'] += 1
+        list.append(self, connection)
+
+    def idleTime(self, connection, now):
+        return now - self.returnedAt.get(id(connection), now)
+
+    def discard(self, connection, reason):
+        list.remove(self, connection)
+        self.returnedAt.pop(id(connection), None)
+        self.checkedAt.pop(id(connection), None)
+        closeQuietly(connection)
+        self.stats[reason] += 1
+
+    #   evict:
+    #   Close every spare connection that's been idle for longer than the idle timeout, and check
+    #   the ones that haven't been used or checked for longer than pingAfter, closing those that
+    #   fail.
+    #
+    def evict(self, now=None):
+        now = now or time.time()
+        for connection in list.__getitem__(self, slice(None)):
+            if self.idleTime(connection, now) > self.idleTimeout:
+                self.discard(connection, 'evicted')
+            elif now - self.checkedAt.get(id(connection), self.returnedAt.get(id(connection), now)) > self.pingAfter:
+                try:
+                    ping(connection)
+                    self.checkedAt[id(connection)] = now
+                except Exception:
+                    self.discard(connection, 'failed')
+
+    def __len__(self):
+        self.evict()
+        return list.__len__(self)
+
+    def pop(self, *args):
+        self.evict()
+        if not list.__len__(self):
+            raise IndexError('no connection in the pool is fit to use')
+        connection = list.pop(self, *args)
+        self.returnedAt.pop(id(connection), None)
+        self.checkedAt.pop(id(connection), None)
+        self.stats['checkouts'] += 1
+        self.stats['reused'] += 1
+        return connection
+
+    def opened(self):
+        with lock:
+            self.stats['checkouts'] += 1
+            self.stats['opened'] += 1
+
+    def status(self):
+        return dict(self.stats, name=self.name, size=self.size, idle=list.__len__(self),
+            idleTimeout=self.idleTimeout, pingAfter=self.pingAfter)
+
+
+#   connect:
+#   A DAL for the given logical database, whose connections come from that database's pool.  The
+#   pool is made the first time, with the given size and timeouts; other arguments go to the DAL.
+#
+def connect(name, uri, size, idleTimeout=IDLE_TIMEOUT, pingAfter=PING_AFTER, **attributes):
+    with lock:
+        pool = POOLS.get(name)
+        if pool is None:
+            pool = POOLS[name] = Pool(name, size, idleTimeout, pingAfter)
+        ConnectionPool.POOLS[uri] = pool
+    ConnectionPool.check_active_connection = False
+    return DAL(uri, pool_size=size, after_connection=lambda adapter: pool.opened(), **attributes)
+
+
+#   poolStats:
+#   What each pool has been up to since the process started: how many connections were checked
+#   out, how many of those were reused or had to be opened because no spare one was fit to use,
+#   how many were returned, closed for being idle too long ('evicted') or for failing a check
+#   ('failed'), and how many are spare right now ('idle').
+#
+def poolStats():
+    with lock:
+        return dict((name, pool.status()) for name, pool in POOLS.items())
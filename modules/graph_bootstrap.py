@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+#
+#   graph_bootstrap.py
+#
+#   The records every concept graph starts with: the ROOT concept, the root of the tree of all
+#   concepts, and the 'in' and 'is a' relations, along with the part for ROOT and an 'in' and 'is a'
+#   link ending on it.  They're created once by bootstrap(), run from /cron/bootstrap.py when the
+#   site starts, so the page handlers only ever have to read them.  It also makes the single rows of
+#   the graph_version and graph_sequence tables, which saves would otherwise make the first time
+#   they need them - and two first saves at once would each make one.
+#
+
+#   the concepts we need, with their descriptions
+CONCEPTS = (
+    ('ROOT', 'root of the concept tree'),
+    ('in', 'one concept belongs within another'),
+    ('is a', 'one concept is an instance of another'),
+)
+
+
+#   bootstrap:
+#   Create whichever of the records above don't exist yet.  Safe to run any number of times; the
+#   caller commits.
+#
+def bootstrap(db):
+
+    for name, description in CONCEPTS:
+        db.concept.update_or_insert(db.concept.name == name, name=name, description=description)
+
+    rootId = db(db.concept.name == 'ROOT').select().first().id
+    inId = db(db.concept.name == 'in').select().first().id
+    isAId = db(db.concept.name == 'is a').select().first().id
+
+    db.part.update_or_insert(db.part.concept == rootId, concept=rootId)
+    rootNode = db(db.part.concept == rootId).select().first().id
+
+    db.part.update_or_insert((db.part.concept == inId) & (db.part.end == rootNode),
+        concept=inId, end=rootNode)
+    db.part.update_or_insert((db.part.concept == isAId) & (db.part.end == rootNode),
+        concept=isAId, end=rootNode)
+
+    if db(db.graph_version).isempty():
+        db.graph_version.insert(version=0)
+    for table in ('concept', 'part'):
+        if db(db.graph_sequence.table_name == table).isempty():
+            maxId = db[table].id.max()
+            highest = db(db[table]).select(maxId).first()[maxId] or 0
+            db.graph_sequence.insert(table_name=table, next_id=highest + 1)
+
+
+def findWellKnownIds(db):
+    ids = {}
+    for name, description in CONCEPTS:
+        row = db(db.concept.name == name).select(db.concept.id, limitby=(0, 1)).first()
+        ids[name] = row.id if row else None
+    row = db(db.part.concept == ids['ROOT']).select(db.part.id, limitby=(0, 1)).first() \
+        if ids['ROOT'] else None
+    ids['root part'] = row.id if row else None
+    return ids
+
+
+#   wellKnownIds:
+#   The ids of the concepts above by name, plus the id of the ROOT part as 'root part', looked up
+#   once per process and then kept in cache.ram.  If the graph hasn't been bootstrapped, the missing
+#   ones are None, and we look again next time.
+#
+def wellKnownIds(db, cache):
+    ids = cache.ram('well_known_ids', lambda: findWellKnownIds(db), time_expire=None)
+    if None in ids.values():
+        cache.ram('well_known_ids', None)
+    return ids
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+#
+#   graph_changes.py
+#
+#   Keeps track of how the concept graph changes over time, so clients that already have the graph
+#   can ask for just what changed since they loaded it.
+#
+#   The graph has a version number, stored in the single row of the 'graph_version' table.  Each save
+#   bumps it once, and every concept or part inserted, updated or deleted by that save gets a row in
+#   'graph_change' tagged with the new version.  Bumping the version is an UPDATE on that one row,
+#   which holds a row lock until the save commits, so versions become visible in the order they
+#   were handed out - a client that has seen version N can never miss a change numbered N or below.
+#   Since every save waits on that lock, saves bump the version last, after writing their records
+#   (see saveGraph in graph_save.py).
+#
+
+from graph_load import selectByIds
+
+
+TABLES = ('concept', 'part')
+
+
+def currentVersion(db):
+    row = db(db.graph_version).select(db.graph_version.version, limitby=(0, 1)).first()
+    return row.version if row else 0
+
+
+#   bumpVersion:
+#   Start a new version of the graph; call this once per save, as its last write before logging its
+#   changes and committing.
+#
+def bumpVersion(db):
+    if not db(db.graph_version).update(version=db.graph_version.version + 1):
+        db.graph_version.insert(version=1)
+    return currentVersion(db)
+
+
+#   loadChanges:
+#   Everything that changed after the given version, in the same shape as a full load.  Records
+#   that were deleted come back as {'id': id, 'deleted': True}, which is what Page.store expects.
+#
+def loadChanges(db, since):
+
+    version = currentVersion(db)
+    records = {'concept': {}, 'part': {}, 'version': version}
+
+    changed = dict((table, set()) for table in TABLES)
+    query = (db.graph_change.version > since) & (db.graph_change.version <= version)
+    for change in db(query).iterselect(db.graph_change.table_name, db.graph_change.record_id):
+        if change.table_name in changed:
+            changed[change.table_name].add(change.record_id)
+
+    for table in TABLES:
+        for row in selectByIds(db, table, changed[table]):
+            records[table][row.id] = row.as_dict()
+        for rid in changed[table]:
+            if rid not in records[table]:
+                records[table][rid] = {'id': rid, 'deleted': True}
+
+    return records
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+#
+#   graph_format.py
+#
+#   The 'columnar' wire format for concept and part records.  Normally each table is sent as an
+#   object mapping id to record, which repeats every field name (and the id) for every record.  In
+#   the columnar format each table is instead a list of blocks, each holding one array per field:
+#
+#       {'format': 'columnar',
+#        'part': [{'id': [5, 6], 'concept': [3, 4], 'start': [None, 5], 'end': [None, 2]}, ...],
+#        'concept': [...]}
+#
+#   Records are split into blocks so a streamed response can write one block at a time, and a block
+#   may also have a 'key' column (see columnBlocks).  A record that lacks a field some other record
+#   in its block has gets None in that column; for the flags below, a None means the record doesn't
+#   have the flag at all.  The matching JavaScript is Table.fromColumns and Table.toColumns in
+#   /static/js/knowledge/databaseWrappers.js.
+#
+
+TABLES = ('concept', 'part')
+
+#   keys that are only present on some records, so a None in their column means "absent"
+FLAG_KEYS = ('id', 'deleted', 'oldId')
+
+BLOCK_SIZE = 500
+
+
+def isColumnar(request_vars):
+    return request_vars.get('format') == 'columnar'
+
+
+#   columnBlocks:
+#   Turn an iterable of (key, record) pairs into column blocks of up to 'size' records each.  The
+#   key is normally the record's id; if any record in a block is filed under something else (like
+#   the temporary id of a record the client hasn't saved yet), the block gets a 'key' column too.
+#
+def columnBlocks(items, size=BLOCK_SIZE):
+    block = []
+    for item in items:
+        block.append(item)
+        if len(block) >= size:
+            yield toBlock(block)
+            block = []
+    if block:
+        yield toBlock(block)
+
+
+def toBlock(items):
+    keys = []
+    for key, record in items:
+        for field in record:
+            if field not in keys:
+                keys.append(field)
+    block = dict((field, [record.get(field) for key, record in items]) for field in keys)
+    if any(str(record.get('id')) != str(key) for key, record in items):
+        block['key'] = [key for key, record in items]
+    return block
+
+
+def fromBlocks(blocks):
+    records = {}
+    for block in blocks:
+        keys = block.get('key') or block['id']
+        fields = [field for field in block if field != 'key']
+        for i in range(len(keys)):
+            record = {}
+            for field in fields:
+                value = block[field][i]
+                if value is not None or field not in FLAG_KEYS:
+                    record[field] = value
+            records[str(keys[i])] = record
+    return records
+
+
+#   toColumnar / fromColumnar:
+#   Convert a whole response or request between the usual format and the columnar one, leaving
+#   anything other than the tables (eg. the graph version) as it is.
+#
+def toColumnar(data):
+    for table in TABLES:
+        if table in data:
+            data[table] = list(columnBlocks(data[table].items()))
+    data['format'] = 'columnar'
+    return data
+
+
+def fromColumnar(data):
+    for table in TABLES:
+        if table in data:
+            data[table] = fromBlocks(data[table])
+    return data
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+#
+#   graph_index.py
+#
+#   An in-memory copy of the 'part' table, indexed both ways, so that graph traversals don't have to
+#   go to the database at all.  The 'part' table is a pure edge list - each part has a concept and
+#   optionally a start and end part - so the index just keeps those three columns (and the revision)
+#   in dicts keyed by part id, plus the reverse: for each part, the ids of the parts that start or
+#   end on it.
+#
+#   There is one index per database in each web2py process, kept in cache.ram and built the first
+#   time it's needed.  It remembers which graph version it reflects (see /modules/graph_changes.py).
+#   Saves made by this process patch it directly, once they've committed; before each read we
+#   compare its version against the database, and if another process has saved since, we patch in
+#   just the parts listed in the change log.
+#
+#   Requests run in threads, so the index is only read or changed holding its lock, and readers get
+#   copies of the records, which a save in another thread can't change under them.
+#
+
+import threading
+
+from graph_changes import currentVersion
+from graph_load import selectByIds, loadConcepts
+
+
+class PartIndex(object):
+
+    def __init__(self):
+        self.version = None
+        self.concept = {}
+        self.start = {}
+        self.end = {}
+        self.revision = {}
+        self.links = {}
+        self.lock = threading.RLock()
+
+    def clear(self):
+        self.concept.clear()
+        self.start.clear()
+        self.end.clear()
+        self.revision.clear()
+        self.links.clear()
+
+    def has(self, pid):
+        return pid in self.concept
+
+    def record(self, pid):
+        return {'id': pid, 'concept': self.concept[pid], 'start': self.start[pid], 'end': self.end[pid],
+            'revision': self.revision[pid]}
+
+    def add(self, pid, concept, start, end, revision=None):
+        if pid in self.concept:
+            self.remove(pid, cascade=False)
+        self.concept[pid] = concept
+        self.start[pid] = start
+        self.end[pid] = end
+        self.revision[pid] = revision
+        for endpoint in (start, end):
+            if endpoint is not None:
+                self.links.setdefault(endpoint, set()).add(pid)
+
+    #   remove:
+    #   Drop a part from the index.  Like the 'reference part' foreign keys in the database, deleting
+    #   a part also deletes every part that starts or ends on it, unless we're only replacing it.
+    #
+    def remove(self, pid, cascade=True):
+        doomed = [pid]
+        while doomed:
+            pid = doomed.pop()
+            if pid not in self.concept:
+                continue
+            for endpoint in (self.start.pop(pid), self.end.pop(pid)):
+                links = self.links.get(endpoint)
+                if links is not None:
+                    links.discard(pid)
+                    if not links:
+                        del self.links[endpoint]
+            del self.concept[pid]
+            del self.revision[pid]
+            if cascade:
+                doomed.extend(self.links.get(pid, ()))
+
+    def neighbors(self, pid):
+        neighbors = [p for p in (self.start.get(pid), self.end.get(pid)) if p is not None]
+        neighbors.extend(self.links.get(pid, ()))
+        return neighbors
+
+    #   reachable:
+    #   Ids of all parts reachable from the given roots, found breadth-first.
+    #
+    def reachable(self, rootIds):
+        with self.lock:
+            found = set(pid for pid in rootIds if pid in self.concept)
+            frontier = list(found)
+            while frontier:
+                nextLevel = []
+                for pid in frontier:
+                    for neighbor in self.neighbors(pid):
+                        if neighbor not in found and neighbor in self.concept:
+                            found.add(neighbor)
+                            nextLevel.append(neighbor)
+                frontier = nextLevel
+            return found
+
+    #   records:
+    #   Copies of the records of whichever of the given parts are in the index.
+    #
+    def records(self, pids):
+        with self.lock:
+            return [self.record(pid) for pid in pids if pid in self.concept]
+
+    #   snapshot:
+    #   Copies of the records of all parts reachable from the given roots.
+    #
+    def snapshot(self, rootIds):
+        with self.lock:
+            return [self.record(pid) for pid in self.reachable(rootIds)]
+
+    #   expand:
+    #   For each of the given parts, and each part that starts or ends on one of them, its record
+    #   along with the neighbors it leads to - see expandBatch in graph_load.py.
+    #
+    def expand(self, pids):
+        expanded = []
+        with self.lock:
+            for pid in pids:
+                if pid in self.concept:
+                    expanded.append((self.record(pid), (self.start[pid], self.end[pid])))
+                for link in self.links.get(pid, ()):
+                    expanded.append((self.record(link), (link,)))
+        return expanded
+
+    #   load:
+    #   Same result as the loaders in graph_load.py; only the concepts come from the database.
+    #
+    def load(self, db, rootIds, records=None):
+        if records is None:
+            records = {'concept': {}, 'part': {}}
+        for part in self.snapshot(rootIds):
+            records['part'][part['id']] = part
+        loadConcepts(db, [part['concept'] for part in records['part'].values()], records)
+        return records
+
+    #   patch:
+    #   Apply the part records written by a save, which created the given graph version; fields a
+    #   record leaves out keep their current values.  If the index is missing versions in between, we
+    #   leave it alone and let sync() catch up from the change log.
+    #
+    def patch(self, version, parts):
+        with self.lock:
+            if self.version != version - 1:
+                return
+            for part in parts:
+                pid = int(part['id'])
+                if part.get('deleted'):
+                    self.remove(pid)
+                else:
+                    values = self.record(pid) if pid in self.concept else {}
+                    values.update(part)
+                    self.add(pid, *[None if values.get(field) is None else int(values[field])
+                        for field in ('concept', 'start', 'end', 'revision')])
+            self.version = version
+
+    def fill(self, db):
+        self.clear()
+        self.version = currentVersion(db)
+        for part in db(db.part).iterselect():
+            self.add(part.id, part.concept, part.start, part.end, part.revision)
+
+    #   sync:
+    #   Bring the index up to date with the database.
+    #
+    def sync(self, db):
+        with self.lock:
+            version = currentVersion(db)
+            if version == self.version:
+                return
+            if self.version is None or version < self.version:
+                self.fill(db)
+                return
+            query = (db.graph_change.version > self.version) & (db.graph_change.version <= version) \
+                & (db.graph_change.table_name == 'part')
+            changed = set(change.record_id for change in db(query).iterselect(db.graph_change.record_id))
+            for part in selectByIds(db, 'part', changed):
+                self.add(part.id, part.concept, part.start, part.end, part.revision)
+                changed.discard(part.id)
+            for pid in changed:
+                self.remove(pid)
+            self.version = version
+
+
+def buildIndex(db):
+    index = PartIndex()
+    index.fill(db)
+    return index
+
+
+#   partIndex:
+#   The index of the given database shared by all requests in this process, built if need be and
+#   synced with the database unless the caller is about to patch it anyway.  A read replica gets an
+#   index of its own, since it can be behind the primary.
+#
+def partIndex(db, cache, sync=True):
+    index = cache.ram('part_index_%s' % db._uri_hash, lambda: buildIndex(db), time_expire=None)
+    if sync:
+        index.sync(db)
+    return index
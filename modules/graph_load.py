@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*-
+
+#
+#   graph_load.py
+#
+#   Engines used by the 'load' handler in /controllers/default.py to pull the concept graph out of
+#   the database.  Each engine returns records in the shape that Page.store in
+#   /static/js/knowledge/databaseWrappers.js expects:
+#
+#       {'concept': {id: {...}, ...}, 'part': {id: {...}, ...}}
+#
+#   The graph is stored as an edge list in the 'part' table, so "the graph reachable from a part"
+#   means: the part itself, its concept, its start and end parts, and every part whose start or end
+#   is this part - repeated until nothing new turns up.
+#
+
+import base64
+import json
+
+from graph_format import columnBlocks
+from sql_helpers import sqlTable
+
+#   how many ids we put in a single 'belongs' clause; keeps the generated SQL well below the
+#   statement size limits of SQLite and MySQL
+BATCH_SIZE = 500
+
+
+def chunks(ids, size=BATCH_SIZE):
+    ids = list(ids)
+    for i in range(0, len(ids), size):
+        yield ids[i:i+size]
+
+
+#   selectByIds:
+#   Select all rows of a table whose id is in the given collection, batching the ids.
+#
+def selectByIds(db, table, ids):
+    for batch in chunks(ids):
+        for row in db(db[table].id.belongs(batch)).iterselect():
+            yield row
+
+
+#   loadConcepts:
+#   Add the concepts with the given ids to the records, fetching only those we don't have yet.
+#
+def loadConcepts(db, conceptIds, records):
+    missing = set(cid for cid in conceptIds if cid is not None and cid not in records['concept'])
+    for concept in selectByIds(db, 'concept', missing):
+        records['concept'][concept.id] = concept.as_dict()
+
+
+#   loadGraph:
+#   Breadth-first load of everything reachable from the given root parts.
+#
+#   Each pass expands a whole frontier of part ids at once: a single query per batch of ids pulls
+#   the frontier parts themselves along with every part that starts or ends on one of them, then
+#   one more query per batch pulls the concepts of all parts found in that pass.  So the number of
+#   queries grows with the depth of the graph rather than its size.
+#
+def loadGraph(db, rootIds, records=None):
+
+    if records is None:
+        records = {'concept': {}, 'part': {}}
+    parts = records['part']
+
+    expanded = set()
+    frontier = set(rootIds)
+
+    while frontier:
+        expanded |= frontier
+        found = []
+
+        for batch in chunks(frontier):
+            query = db.part.id.belongs(batch) | db.part.start.belongs(batch) | db.part.end.belongs(batch)
+            for part in db(query).iterselect():
+                if part.id not in parts:
+                    parts[part.id] = part.as_dict()
+                    found.append(part)
+
+        frontier = set()
+        for part in found:
+            for pid in (part.id, part.start, part.end):
+                if pid is not None and pid not in expanded:
+                    frontier.add(pid)
+
+        loadConcepts(db, [part.concept for part in found], records)
+
+    return records
+
+
+#   RECURSIVE QUERIES
+#   SQLite (3.8.3+), MySQL (8.0+) and PostgreSQL can compute the whole reachable set in the database
+#   with a recursive common table expression.  'link' lists every edge of the graph in both
+#   directions, and 'reach' follows those edges out from the root parts.  The UNION (as opposed to
+#   UNION ALL) discards parts we have already reached, which is what makes the recursion stop.
+
+RECURSIVE_BACKENDS = ('sqlite', 'mysql', 'postgres')
+
+#   uris of databases that turned out not to support recursive queries (eg. MySQL 5.x), so we only
+#   pay for the failed query once per process
+noRecursive = set()
+
+
+def reachSQL(db, rootIds):
+    part = db.part
+    table, pid, start, end = sqlTable(part), part.id.sqlsafe, part.start.sqlsafe, part.end.sqlsafe
+    roots = ', '.join(str(int(rid)) for rid in rootIds)
+    return ('WITH RECURSIVE link(a, b) AS ('
+            ' SELECT %(id)s, %(start)s FROM %(table)s WHERE %(start)s IS NOT NULL'
+            ' UNION ALL SELECT %(start)s, %(id)s FROM %(table)s WHERE %(start)s IS NOT NULL'
+            ' UNION ALL SELECT %(id)s, %(end)s FROM %(table)s WHERE %(end)s IS NOT NULL'
+            ' UNION ALL SELECT %(end)s, %(id)s FROM %(table)s WHERE %(end)s IS NOT NULL'
+            '), reach(id) AS ('
+            ' SELECT %(id)s FROM %(table)s WHERE %(id)s IN (%(roots)s)'
+            ' UNION SELECT link.b FROM link JOIN reach ON link.a = reach.id'
+            ') ') % dict(table=table, id=pid, start=start, end=end, roots=roots)
+
+
+def supportsRecursive(db):
+    return db._adapter.dbengine in RECURSIVE_BACKENDS and db._uri not in noRecursive
+
+
+#   reachableIds:
+#   The set of ids of all parts reachable from the root parts, in one query if the backend allows.
+#
+def reachableIds(db, rootIds):
+    if supportsRecursive(db):
+        try:
+            return set(row[0] for row in db.executesql(reachSQL(db, rootIds) + 'SELECT id FROM reach'))
+        except Exception:
+            db.rollback()
+            noRecursive.add(db._uri)
+    return set(loadGraph(db, rootIds)['part'])
+
+
+#   loadGraphRecursive:
+#   Same result as loadGraph, but the traversal happens inside the database: one query returns all
+#   reachable parts, and the concepts come in one more query per batch.  Falls back to loadGraph
+#   on backends without recursive queries.
+#
+def loadGraphRecursive(db, rootIds, records=None):
+
+    if records is None:
+        records = {'concept': {}, 'part': {}}
+    if not supportsRecursive(db):
+        return loadGraph(db, rootIds, records)
+
+    fields = db.part.fields
+    sql = reachSQL(db, rootIds) + 'SELECT %s FROM %s WHERE %s IN (SELECT id FROM reach)' % (
+        ', '.join(db.part[field].sqlsafe for field in fields), sqlTable(db.part), db.part.id.sqlsafe)
+    try:
+        rows = db.executesql(sql)
+    except Exception:
+        db.rollback()
+        noRecursive.add(db._uri)
+        return loadGraph(db, rootIds, records)
+
+    for row in rows:
+        part = dict(zip(fields, row))
+        records['part'][part['id']] = part
+
+    loadConcepts(db, [part['concept'] for part in records['part'].values()], records)
+    return records
+
+
+#   BOUNDED LOADS
+#   loadNeighborhood loads only part of the graph around a root: at most 'depth' hops out and
+#   roughly 'limit' parts, whichever comes first.  Whatever it didn't get to is described by an
+#   opaque cursor the client can send back to continue where it left off.  A load that stopped at
+#   its depth gives a cursor too, which goes the same number of hops further out.
+#
+#   Here a hop is a single edge of the part graph - from a part to its start or end, or to a part
+#   that starts or ends on it - so a node and the nodes it links to are two hops apart.  Because
+#   the walk is a true breadth-first search, the neighbors of a level can only lie in the previous,
+#   current or next level, so those three levels are all the cursor has to remember.
+
+def encodeCursor(state):
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(',', ':')).encode('utf8')).decode('ascii')
+
+
+def decodeCursor(cursor):
+    try:
+        state = json.loads(base64.urlsafe_b64decode(str(cursor)).decode('utf8'))
+        return dict((key, state[key]) for key in ('level', 'depth', 'hops', 'previous', 'current', 'frontier', 'next'))
+    except (TypeError, ValueError, KeyError):
+        raise ValueError('invalid cursor')
+
+
+#   loadEndpoints:
+#   Make sure the start and end of every loaded part is loaded too, since the client can't store
+#   a part whose endpoints it doesn't have.  Any parts in partIds are loaded as well.
+#
+def loadEndpoints(db, records, partIds=(), index=None):
+    parts = records['part']
+    missing = set(pid for pid in partIds if pid not in parts)
+    for part in parts.values():
+        missing.update(pid for pid in (part['start'], part['end']) if pid is not None and pid not in parts)
+    while missing:
+        if index is not None:
+            found = index.records(missing)
+        else:
+            found = [part.as_dict() for part in selectByIds(db, 'part', missing)]
+        missing = set()
+        for part in found:
+            parts[part['id']] = part
+        for part in found:
+            missing.update(pid for pid in (part['start'], part['end']) if pid is not None and pid not in parts)
+
+
+#   expandBatch:
+#   For each part in the batch, and each part that starts or ends on one in the batch, yield its
+#   record along with the neighbors that it leads to: a batch part leads to its start and end, and
+#   any other part leads to itself.  Uses the in-memory part index if we're given one.
+#
+def expandBatch(db, batch, index=None):
+    if index is not None:
+        for expanded in index.expand(batch):
+            yield expanded
+        return
+    batchIds = set(batch)
+    query = db.part.id.belongs(batch) | db.part.start.belongs(batch) | db.part.end.belongs(batch)
+    for part in db(query).iterselect():
+        if part.id in batchIds:
+            yield part.as_dict(), (part.start, part.end)
+        else:
+            yield part.as_dict(), (part.id,)
+
+
+#   loadNeighborhood:
+#   Load the graph around the given root parts, or continue a previous load given its cursor.
+#   Returns the records along with:
+#       frontier: ids of parts whose neighbors have not been loaded yet
+#       cursor: pass this back to continue the load - past the depth, if that's where it stopped -
+#           or None if there is nothing left
+#   If we're given the in-memory part index (see graph_index.py), only the concepts come from the
+#   database.
+#
+def loadNeighborhood(db, rootIds, depth=None, limit=None, cursor=None, index=None):
+
+    if cursor:
+        state = decodeCursor(cursor)
+    else:
+        rootIds = [int(rid) for rid in rootIds]
+        state = {'level': 0, 'depth': depth, 'hops': depth, 'previous': [], 'current': rootIds,
+            'frontier': rootIds, 'next': []}
+
+    level, depth = state['level'], state['depth']
+    previous, current, nextLevel = set(state['previous']), set(state['current']), state['next']
+    frontier = list(state['frontier'])
+    seen = previous | current | set(nextLevel)
+
+    records = {'concept': {}, 'part': {}}
+    parts = records['part']
+
+    while depth is None or level < depth:
+
+        while frontier and (limit is None or len(parts) < limit):
+            size = BATCH_SIZE if limit is None else max(1, min(BATCH_SIZE, limit - len(parts)))
+            batch, frontier = frontier[:size], frontier[size:]
+            for part, neighbors in expandBatch(db, batch, index):
+                parts[part['id']] = part
+                for pid in neighbors:
+                    if pid is not None and pid not in seen:
+                        seen.add(pid)
+                        nextLevel.append(pid)
+
+        if frontier or not nextLevel:
+            break
+
+        level += 1
+        previous, current = current, set(nextLevel)
+        frontier, nextLevel = list(nextLevel), []
+        seen = previous | current
+
+    loadEndpoints(db, records, state['current'] if level == 0 else (), index)
+    loadConcepts(db, [part['concept'] for part in parts.values()], records)
+
+    if depth is not None and level >= depth:
+        remaining = list(frontier)
+    else:
+        remaining = frontier + nextLevel
+    records['frontier'] = remaining
+
+    if remaining:
+        if depth is not None and level >= depth:
+            depth = level + max(1, state['hops'])
+        records['cursor'] = encodeCursor({'level': level, 'depth': depth, 'hops': state['hops'],
+            'previous': list(previous), 'current': list(current), 'frontier': frontier, 'next': nextLevel})
+    else:
+        records['cursor'] = None
+
+    return records
+
+
+#   STREAMING
+#   For big graphs, rather than build the whole response in memory and serialize it in one go, we
+#   can write it out a record at a time as we read the rows.  Only the ids of the concepts to send
+#   (and the part records, if they come from the part index) are held in memory.
+
+#   roughly how many characters we collect before handing a chunk to the web server
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def bufferChunks(pieces, size=STREAM_CHUNK_SIZE):
+    buffer, length = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield ''.join(buffer).encode('utf8')
+            buffer, length = [], 0
+    if buffer:
+        yield ''.join(buffer).encode('utf8')
+
+
+def jsonObjectItems(records):
+    separator = ''
+    for record in records:
+        yield '%s"%s": %s' % (separator, record['id'], json.dumps(record))
+        separator = ', '
+
+
+#   iterReachableParts:
+#   Records of all parts reachable from the roots, read off the database cursor a batch at a time
+#   so we never hold all the rows at once.  Backends without recursive queries get the parts from
+#   loadGraph instead.
+#
+def iterReachableParts(db, rootIds):
+    if supportsRecursive(db):
+        fields = db.part.fields
+        sql = reachSQL(db, rootIds) + 'SELECT %s FROM %s WHERE %s IN (SELECT id FROM reach)' % (
+            ', '.join(db.part[field].sqlsafe for field in fields), sqlTable(db.part), db.part.id.sqlsafe)
+        try:
+            db._adapter.execute(sql)
+        except Exception:
+            db.rollback()
+            noRecursive.add(db._uri)
+        else:
+            cursor = db._adapter.cursor
+            rows = cursor.fetchmany(BATCH_SIZE)
+            while rows:
+                for row in rows:
+                    yield dict(zip(fields, row))
+                rows = cursor.fetchmany(BATCH_SIZE)
+            return
+    for part in loadGraph(db, rootIds)['part'].values():
+        yield part
+
+
+#   jsonColumnBlocks:
+#   The same as jsonObjectItems, for the 'columnar' format (see graph_format.py).
+#
+def jsonColumnBlocks(records):
+    separator = ''
+    for block in columnBlocks((record['id'], record) for record in records):
+        yield separator + json.dumps(block)
+        separator = ', '
+
+
+#   streamGraph:
+#   Generate the JSON for the given part records and their concepts, in the same shape as the other
+#   loaders (or in the columnar format), a chunk at a time.  Any items in 'extra' are added to the
+#   top level of the response.
+#
+def streamGraph(db, parts, extra=None, columnar=False):
+
+    conceptIds = set()
+
+    def partRecords():
+        for part in parts:
+            conceptIds.add(part['concept'])
+            yield part
+
+    def conceptRecords():
+        conceptIds.discard(None)
+        for concept in selectByIds(db, 'concept', conceptIds):
+            yield concept.as_dict()
+
+    def pieces():
+        if columnar:
+            items, opening, closing = jsonColumnBlocks, '[', ']'
+            yield '{"format": "columnar", '
+        else:
+            items, opening, closing = jsonObjectItems, '{', '}'
+            yield '{'
+        yield '"part": ' + opening
+        for piece in items(partRecords()):
+            yield piece
+        yield closing + ', "concept": ' + opening
+        for piece in items(conceptRecords()):
+            yield piece
+        yield closing
+        for key, value in (extra or {}).items():
+            yield ', %s: %s' % (json.dumps(key), json.dumps(value))
+        yield '}'
+
+    return bufferChunks(pieces())
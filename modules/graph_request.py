@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+#
+#   graph_request.py
+#
+#   Reads the body of a save request (see the 'save' handler in /controllers/default.py) a chunk
+#   at a time, decoding the concept and part records one by one as they come in.  Reading the whole
+#   body, unquoting it, decoding it to unicode and parsing it would hold several copies of what can
+#   be many megabytes of text at once; this way we only hold one chunk and the record being parsed,
+#   besides the records themselves.
+#
+#   The body looks like
+#
+#       {"records": {"concept": {key: {...}, ...}, "part": {key: {...}, ...}}, "format": ..., ...}
+#
+#   where in the columnar format each table is a list of blocks instead (see graph_format.py).
+#   Anything besides the records is parsed whole.
+#
+
+import codecs
+import json
+
+try:
+    from urllib import unquote
+except ImportError:
+    from urllib.parse import unquote_to_bytes as unquote
+
+from graph_format import fromBlocks
+
+
+#   how many bytes of the body we read at a time
+REQUEST_CHUNK_SIZE = 64 * 1024
+
+WHITESPACE = ' \t\n\r'
+
+#   the characters a JSON number can start with, and go on with
+NUMBER_START = '-0123456789'
+NUMBER_CHARS = '+-.eE0123456789'
+
+
+#   JSONStream:
+#   Walks through a JSON document read from a file-like object.  members() and elements() step
+#   through an object or array, leaving the caller to read each value, either with value() to parse
+#   it whole, or with members() or elements() again to step into it.
+#
+class JSONStream(object):
+
+    def __init__(self, body, size=REQUEST_CHUNK_SIZE):
+        self.body = body
+        self.size = size
+        self.buffer = u''
+        self.pos = 0
+        self.done = False
+        self.pending = b''
+        self.decoder = json.JSONDecoder()
+        self.utf8 = codecs.getincrementaldecoder('utf8')()
+
+    #   fill:
+    #   Read the next chunk onto the end of the buffer, dropping what we've already parsed.  Returns
+    #   False once the body is used up.  The body is URL-quoted, and a chunk can end in the middle of
+    #   a %-escape or a multibyte character, so those are kept back for the next chunk.
+    #
+    def fill(self):
+        if self.done:
+            return False
+        chunk = self.body.read(self.size)
+        if chunk:
+            chunk = self.pending + chunk
+            cut = chunk.rfind(b'%', max(len(chunk) - 2, 0))
+            if cut >= 0:
+                chunk, self.pending = chunk[:cut], chunk[cut:]
+            else:
+                self.pending = b''
+            text = self.utf8.decode(unquote(chunk))
+        else:
+            self.done = True
+            text = self.utf8.decode(unquote(self.pending), True)
+        self.buffer = self.buffer[self.pos:] + text
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self.fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError('expected %s at %r' % (char, self.buffer[self.pos:self.pos + 20]))
+        self.pos += 1
+
+    #   value:
+    #   Parse the next value whole.  If it doesn't parse, or might go on past the end of the buffer,
+    #   we read more and try again, until the body runs out.  A number might go on if nothing but
+    #   number characters follow it in the buffer: '1.' parses as 1, but the next chunk may be '5'.
+    #
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                if not self.fill():
+                    raise
+                continue
+            complete = end < len(self.buffer) and (self.buffer[self.pos] not in NUMBER_START
+                or self.buffer[end:].lstrip(NUMBER_CHARS))
+            if complete or not self.fill():
+                self.pos = end
+                return value
+
+    def members(self):
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.peek() == ',':
+                self.pos += 1
+            else:
+                self.expect('}')
+                return
+
+    def elements(self):
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        index = 0
+        while True:
+            yield index
+            index += 1
+            if self.peek() == ',':
+                self.pos += 1
+            else:
+                self.expect(']')
+                return
+
+
+#   readSaveRequest:
+#   Parse the body of a save request from the given file-like object.  Tables in the columnar format
+#   are converted back to the usual one block by block as we go.  Raises ValueError if the body
+#   isn't valid JSON.
+#
+def readSaveRequest(body):
+    stream = JSONStream(body)
+    request_vars = {}
+    for key in stream.members():
+        if key != 'records':
+            request_vars[key] = stream.value()
+            continue
+        records = request_vars['records'] = {}
+        for table in stream.members():
+            records[table] = {}
+            if stream.peek() == '[':
+                for i in stream.elements():
+                    records[table].update(fromBlocks([stream.value()]))
+            else:
+                for rid in stream.members():
+                    records[table][rid] = stream.value()
+    if stream.peek():
+        raise ValueError('unexpected %r after the request' % stream.buffer[stream.pos:stream.pos + 20])
+    return request_vars
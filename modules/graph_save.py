@@ -0,0 +1,421 @@
+# -*- coding: utf-8 -*-
+
+#
+#   graph_save.py
+#
+#   The engine behind the 'save' handler in /controllers/default.py.  The client sends the concepts
+#   and parts it wants saved in the same shape the loaders return:
+#
+#       {'concept': {key: {...}, ...}, 'part': {key: {...}, ...}}
+#
+#   where an existing record has an 'id' (and the key is that id), a new record has a negative
+#   temporary id as its key and no 'id', and a record to delete has 'deleted' set.  A part's
+#   concept, start and end refer to other records by their keys.  The client only sends the records
+#   it has created, changed or deleted since its last save, so a reference to a positive id that
+#   isn't in the request is to a record already in the database, and is left as it is.  An existing
+#   record may also be sent with just the fields that changed.
+#
+#   Each concept and part has a 'revision', bumped every time it's saved.  The client sends back the
+#   revision it last saw of each record it changes or deletes, and if any of those records has been
+#   saved by someone else in the meantime, nothing is written and we report just those records - see
+#   checkRevisions.  A record sent without a revision is written regardless.
+#
+#   Rather than write the records one at a time, we group them: all deletes of a table go in one
+#   statement per batch, all updates in one UPDATE per batch (each column set through a CASE on the
+#   id), and inserts - of new records and of change log entries - in one multi-row INSERT per batch.
+#   New records get their ids up front from the 'graph_sequence' table (see allocateIds), so every
+#   reference can be rewritten to a real id before anything is written.  New parts are still
+#   inserted in dependency order, so that databases checking foreign keys row by row (MySQL) see
+#   each part's start and end before the part itself.
+#
+
+from datetime import datetime, timedelta
+
+from graph_changes import bumpVersion
+from graph_load import chunks
+from sql_helpers import columnName, sqlTable
+
+
+TABLES = ('concept', 'part')
+
+#   the reference fields of each table, and the table they refer to
+REFERENCES = {
+    'concept': (),
+    'part': (('concept', 'concept'), ('start', 'part'), ('end', 'part')),
+}
+
+
+class SaveError(ValueError):
+    pass
+
+
+#   SaveInProgress:
+#   Raised when a save is sent again while the first one with the same key is still being done (or
+#   we couldn't get at its response), so the client should try again shortly.
+#
+class SaveInProgress(Exception):
+    pass
+
+
+#   SaveConflict:
+#   Raised when records the client changed were saved by someone else first.  'conflicts' holds the
+#   current version of each of those records, in the same shape as a load ({'id': id, 'deleted':
+#   True} if it has since been deleted).
+#
+class SaveConflict(Exception):
+
+    def __init__(self, conflicts):
+        Exception.__init__(self, 'conflicting changes')
+        self.conflicts = conflicts
+
+
+def fieldDefault(field):
+    return field.default() if callable(field.default) else field.default
+
+
+def sqlValue(db, field, value):
+    return db._adapter.represent(value, field.type)
+
+
+#   insertMany:
+#   Insert rows (dicts of field values) with one statement per batch, in the given order.  A row
+#   that lacks a field some other row has gets the field's default.  The database's ids for the rows
+#   are not returned, so give them an 'id' if you need to know it.
+#
+def insertMany(db, table, rows):
+    if not rows:
+        return
+    table = db[table]
+    names = []
+    for row in rows:
+        names.extend(name for name in row if name not in names)
+    fields = [table[name] for name in names]
+    for batch in chunks(rows):
+        values = ', '.join('(%s)' % ', '.join(sqlValue(db, field,
+            row[field.name] if field.name in row else fieldDefault(field)) for field in fields) for row in batch)
+        db.executesql('INSERT INTO %s (%s) VALUES %s' % (
+            sqlTable(table), ', '.join(columnName(field) for field in fields), values))
+
+
+#   updateMany:
+#   Apply updates given as {id: {field: value}} with one UPDATE statement per batch of records.
+#   Each column gets a CASE on the id, falling back to its current value for records that don't
+#   change it.
+#
+def updateMany(db, table, updates):
+    table = db[table]
+    idColumn = columnName(table.id)
+    for batch in chunks(sorted(updates)):
+        names = []
+        for rid in batch:
+            names.extend(name for name in updates[rid] if name not in names)
+        if not names:
+            continue
+        assignments = []
+        for name in names:
+            field = table[name]
+            cases = ' '.join('WHEN %d THEN %s' % (rid, sqlValue(db, field, updates[rid][name]))
+                for rid in batch if name in updates[rid])
+            assignments.append('%s = CASE %s %s ELSE %s END' % (columnName(field), idColumn, cases, columnName(field)))
+        db.executesql('UPDATE %s SET %s WHERE %s IN (%s)' % (
+            sqlTable(table), ', '.join(assignments), idColumn, ', '.join(str(rid) for rid in batch)))
+
+
+def deleteMany(db, table, ids):
+    for batch in chunks(ids):
+        db(db[table].id.belongs(batch)).delete()
+
+
+#   cascadedParts:
+#   The ids of the parts the database deletes along with the given concepts and parts: the parts of
+#   those concepts, the parts that start or end on any of those or on the given parts, and so on.
+#   The given parts themselves aren't included.
+#
+def cascadedParts(db, conceptIds, partIds):
+    part = db.part
+    doomed = set(partIds)
+    frontier = set()
+    for batch in chunks(sorted(conceptIds)):
+        frontier.update(row.id for row in db(part.concept.belongs(batch)).select(part.id))
+    frontier -= doomed
+    doomed |= frontier
+    frontier |= set(partIds)
+    while frontier:
+        found = set()
+        for batch in chunks(sorted(frontier)):
+            query = part.start.belongs(batch) | part.end.belongs(batch)
+            found.update(row.id for row in db(query).select(part.id))
+        frontier = found - doomed
+        doomed |= frontier
+    return doomed - set(partIds)
+
+
+#   allocateIds:
+#   Reserve a block of 'count' ids for new records of the given table.  The UPDATE on the table's
+#   sequence row locks it until the save commits, so two saves can't be handed the same block.  We
+#   also skip past any ids the table already has, in case records were inserted some other way.
+#   The sequence rows are made by graph_bootstrap.bootstrap; if one is missing we make it, and
+#   table_name being unique makes a second save doing the same at the same time fail rather than
+#   add another.
+#
+def allocateIds(db, table, count):
+    if not count:
+        return []
+    sequence = db.graph_sequence
+    query = sequence.table_name == table
+    if not db(query).update(next_id=sequence.next_id + count):
+        sequence.insert(table_name=table, next_id=count + 1)
+    first = db(query).select(sequence.next_id, limitby=(0, 1)).first().next_id - count
+    maxId = db[table].id.max()
+    highest = db(db[table]).select(maxId).first()[maxId] or 0
+    if first <= highest:
+        first = highest + 1
+        db(query).update(next_id=first + count)
+    return list(range(first, first + count))
+
+
+#   checkRevisions:
+#   Lock the rows of the given records until the save commits and return their current revisions,
+#   given {id: revision the client saw, or None}.  Raises SaveConflict listing any record whose
+#   revision has moved on, or that was deleted although the client was updating it.  SQLite has no
+#   row locks, but saveGraph has already locked the database (see lockDatabase).
+#
+def checkRevisions(db, table, expected, conflicts, deleting=()):
+    table = db[table]
+    forUpdate = db._adapter.dbengine != 'sqlite'
+    current = {}
+    for batch in chunks(sorted(expected)):
+        for row in db(table.id.belongs(batch)).select(for_update=forUpdate):
+            current[row.id] = row.revision or 0
+            revision = expected[row.id]
+            if revision is not None and int(revision) != current[row.id]:
+                conflicts[table._tablename][str(row.id)] = row.as_dict()
+    for rid in expected:
+        if rid not in current and rid not in deleting:
+            conflicts[table._tablename][str(rid)] = {'id': rid, 'deleted': True}
+    return current
+
+
+#   orderNewParts:
+#   Order the keys of new parts so each comes after any new part it starts or ends on (Kahn's
+#   algorithm).  Parts caught in a cycle can't be ordered that way; they come last, and are
+#   returned separately so their references to each other can be filled in after they're inserted.
+#
+def orderNewParts(newParts):
+    waitingOn = {}
+    dependents = {}
+    for key, record in newParts.items():
+        deps = set(str(record[field]) for field in ('start', 'end')
+            if record.get(field) is not None and str(record[field]) in newParts and str(record[field]) != key)
+        waitingOn[key] = len(deps)
+        for dep in deps:
+            dependents.setdefault(dep, []).append(key)
+
+    order = [key for key in newParts if waitingOn[key] == 0]
+    i = 0
+    while i < len(order):
+        for dependent in dependents.get(order[i], ()):
+            waitingOn[dependent] -= 1
+            if waitingOn[dependent] == 0:
+                order.append(dependent)
+        i += 1
+
+    ordered = set(order)
+    cyclic = [key for key in newParts if key not in ordered]
+    return order + cyclic, set(cyclic)
+
+
+#   saveRecords:
+#   Write the given records in one go.  Returns the saved records keyed by their (possibly new) id,
+#   in the same shape as before, where a record that got a new id has its old key in 'oldId'; and
+#   the change log entries for them, still without their version.  Raises SaveError if a record
+#   refers to a new record that isn't in the request.  If given, 'progress' is called with a short
+#   message after each stage.
+#
+def saveRecords(db, records, progress=None):
+
+    def report(message):
+        if progress is not None:
+            progress(message)
+
+    fieldNames = dict((table, [name for name in db[table].fields if name != 'id']) for table in TABLES)
+    ids = dict((table, {}) for table in TABLES)
+    inserts = dict((table, {}) for table in TABLES)
+    updates = dict((table, {}) for table in TABLES)
+    deletes = dict((table, {}) for table in TABLES)
+    saved = dict((table, {}) for table in TABLES)
+
+    for table in TABLES:
+        for key, record in records.get(table, {}).items():
+            key = str(key)
+            if 'deleted' in record:
+                if record.get('id') is None:
+                    continue
+                ids[table][key] = int(record['id'])
+                deletes[table][key] = record
+            elif record.get('id') is not None:
+                ids[table][key] = int(record['id'])
+                updates[table][key] = record
+            else:
+                inserts[table][key] = record
+
+    def resolve(table, ref):
+        if ref is None:
+            return None
+        key = str(ref)
+        if key in ids[table]:
+            return ids[table][key]
+        if int(ref) <= 0:
+            raise SaveError('%s %s has not been saved' % (table, ref))
+        return int(ref)
+
+    def fields(table, record, skip=()):
+        values = {}
+        for name in fieldNames[table]:
+            if name in record:
+                values[name] = record[name]
+        for name, target in REFERENCES[table]:
+            if name in values:
+                values[name] = None if name in skip else resolve(target, values[name])
+        return values
+
+    #   make sure nobody else has changed the records we're changing, before we write anything
+    revisions = {}
+    conflicts = dict((table, {}) for table in TABLES)
+    for table in TABLES:
+        expected = dict((ids[table][key], record.get('revision')) for key, record in updates[table].items())
+        for key, record in deletes[table].items():
+            expected[ids[table][key]] = record.get('revision')
+        revisions[table] = checkRevisions(db, table, expected, conflicts,
+            deleting=set(ids[table][key] for key in deletes[table]))
+    if any(conflicts.values()):
+        raise SaveConflict(conflicts)
+    report('checked revisions')
+
+    #   give the new records their ids, then insert them: concepts, then parts in dependency order
+    for table in TABLES:
+        ids[table].update(zip(inserts[table], allocateIds(db, table, len(inserts[table]))))
+    rows = []
+    for key, record in inserts['concept'].items():
+        saved['concept'][key] = dict(fields('concept', record), revision=1)
+        rows.append(dict(saved['concept'][key], id=ids['concept'][key]))
+    insertMany(db, 'concept', rows)
+    order, cyclic = orderNewParts(inserts['part'])
+    rows = []
+    for key in order:
+        record = inserts['part'][key]
+        skip = [name for name in ('start', 'end') if key in cyclic and str(record.get(name)) in cyclic]
+        saved['part'][key] = dict(fields('part', record, skip), revision=1)
+        rows.append(dict(saved['part'][key], id=ids['part'][key]))
+        if skip:
+            updates['part'][key] = dict((name, record[name]) for name in skip)
+    insertMany(db, 'part', rows)
+    report('inserted %d concepts, %d parts' % (len(inserts['concept']), len(inserts['part'])))
+
+    #   updates, including the references of new parts that were part of a cycle
+    for table in TABLES:
+        changes = {}
+        for key, record in updates[table].items():
+            values = fields(table, record)
+            if key in inserts[table]:
+                values.pop('revision', None)
+            else:
+                values['revision'] = revisions[table][ids[table][key]] + 1
+            changes[ids[table][key]] = values
+            saved[table].setdefault(key, {}).update(values)
+        updateMany(db, table, changes)
+    report('updated %d concepts, %d parts' % (len(updates['concept']), len(updates['part'])))
+
+    #   the database deletes the parts that depend on the deleted records along with them, so those
+    #   are logged and returned as deleted too
+    deleted = dict((table, [ids[table][key] for key in deletes[table]]) for table in TABLES)
+    cascaded = cascadedParts(db, deleted['concept'], deleted['part'])
+    deleteMany(db, 'part', deleted['part'] + sorted(cascaded))
+    deleteMany(db, 'concept', deleted['concept'])
+    report('deleted %d concepts, %d parts, and %d parts that depended on them' % (
+        len(deleted['concept']), len(deleted['part']), len(cascaded)))
+
+    log = []
+    result = dict((table, {}) for table in TABLES)
+    for table in TABLES:
+        for key, values in saved[table].items():
+            rid = ids[table][key]
+            if table == 'part' and rid in cascaded:
+                continue
+            record = dict(values, id=rid)
+            if str(rid) != key:
+                record['oldId'] = key
+            result[table][str(rid)] = record
+            log.append({'table_name': table, 'record_id': rid, 'deleted': False})
+        for rid in deleted[table] + (sorted(cascaded) if table == 'part' else []):
+            result[table][str(rid)] = {'id': rid, 'deleted': True}
+            log.append({'table_name': table, 'record_id': rid, 'deleted': True})
+
+    return result, log
+
+
+#   lockDatabase:
+#   SQLite has no row locks, and reads don't lock anything, so a save takes the database's write
+#   lock with a write that changes nothing before it checks any revisions.  Other databases lock
+#   just the rows the save reads and writes.
+#
+def lockDatabase(db):
+    if db._adapter.dbengine == 'sqlite':
+        db(db.graph_version).update(version=db.graph_version.version)
+
+
+#   saveGraph:
+#   A whole save, as done by the 'save' handler or a background save job: write the records, then
+#   bump the graph version and log them as changed in it.  The version is bumped last, since it
+#   locks the graph_version row until the save commits, and every other save waits on that lock -
+#   so they only wait for the end of this one, not all of it.  Returns the saved records along with
+#   the new 'version'.  Nothing is written if it fails; otherwise it's up to the caller to commit
+#   straight away, and then to patch its part index with the saved parts (see graph_index.py) - not
+#   before, or a load in between would find the index ahead of the database.
+#
+def saveGraph(db, records, progress=None):
+    try:
+        lockDatabase(db)
+        saved, log = saveRecords(db, records, progress)
+        version = bumpVersion(db)
+        for entry in log:
+            entry['version'] = version
+        insertMany(db, 'graph_change', log)
+    except Exception:
+        db.rollback()
+        raise
+    saved['version'] = version
+    return saved
+
+
+#   IDEMPOTENT SAVES
+#   A client can send a save with an 'Idempotency-Key' header, and send it again with the same key if
+#   it never got the response.  The first save to claim a key records its response in the
+#   'save_request' table in the same transaction, and a save with a key that's already been used
+#   just gets that response back.  Keys are forgotten after SAVE_REQUEST_TTL.
+
+SAVE_REQUEST_TTL = timedelta(days=1)
+
+
+#   claimRequest:
+#   Claim the key for this save, or if another save already has, return the response it recorded.
+#   Call this before writing anything, as it may roll back the transaction.  If two saves with the
+#   same key arrive at once, the second one waits on the unique key until the first commits; if the
+#   first still hasn't recorded a response after that, we raise SaveInProgress.
+#
+def claimRequest(db, key):
+    requests = db.save_request
+    try:
+        db(requests.created_on < datetime.utcnow() - SAVE_REQUEST_TTL).delete()
+        requests.insert(request_key=key, created_on=datetime.utcnow())
+        return None
+    except Exception:
+        db.rollback()
+        row = db(requests.request_key == key).select(requests.response, limitby=(0, 1)).first()
+        if row is None or row.response is None:
+            raise SaveInProgress('the save with this key is still in progress')
+        return row.response
+
+
+def recordResponse(db, key, response):
+    db(db.save_request.request_key == key).update(response=response)
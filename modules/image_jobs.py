@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+#
+#   image_jobs.py
+#
+#   Runs image work - decoding a large scan, resizing it, encoding the copies - in a pool of worker
+#   processes, so the request that uploaded the image returns straight away and the work spreads
+#   across cores instead of holding up a web worker for seconds.  Each job has a key (for painting
+#   images, the upload name), by which its status can be looked up, and submitting a key that's
+#   already queued doesn't queue it again.
+#
+#   The queue is bounded: when that many jobs are waiting or running, submit turns new ones away,
+#   and the caller does without - the images handler makes any copy that's missing when it's asked
+#   for anyway.  The pool belongs to the web server process, so statuses are only known to the
+#   process that ran the job.
+#
+
+from collections import OrderedDict
+import multiprocessing
+import threading
+
+
+#   defaults for the number of worker processes and the most jobs waiting or running at once
+WORKERS = 2
+QUEUE_SIZE = 50
+
+#   how many finished jobs we remember the status of
+KEEP_FINISHED = 1000
+
+#   each worker process is replaced after this many jobs, so memory Pillow holds onto is given back
+TASKS_PER_WORKER = 50
+
+lock = threading.Lock()
+
+#   the runner of this process, made by runner()
+RUNNER = []
+
+
+class JobRunner(object):
+
+    def __init__(self, workers=WORKERS, queueSize=QUEUE_SIZE):
+        self.workers = workers
+        self.queueSize = queueSize
+        self.pool = multiprocessing.Pool(workers, maxtasksperchild=TASKS_PER_WORKER)
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {'submitted': 0, 'rejected': 0, 'duplicate': 0}
+
+    def pending(self):
+        return [key for key, result in self.jobs.items() if not result.ready()]
+
+    #   forget the oldest finished jobs past the ones we keep
+    def prune(self):
+        finished = [key for key, result in self.jobs.items() if result.ready()]
+        for key in finished[:max(0, len(finished) - KEEP_FINISHED)]:
+            del self.jobs[key]
+
+    #   submit:
+    #   Queue function(*args) in a worker process under the given key.  Returns True if it's queued
+    #   (or already was), False if the queue is full.  The function and its arguments have to be
+    #   picklable, so the function must be defined at the top level of a module.
+    #
+    def submit(self, key, function, *args):
+        with self.lock:
+            result = self.jobs.get(key)
+            if result is not None and not result.ready():
+                self.stats['duplicate'] += 1
+                return True
+            if len(self.pending()) >= self.queueSize:
+                self.stats['rejected'] += 1
+                return False
+            self.jobs.pop(key, None)
+            self.jobs[key] = self.pool.apply_async(function, args)
+            self.stats['submitted'] += 1
+            self.prune()
+            return True
+
+    #   status:
+    #   'pending' (waiting or running), 'done', 'failed', or 'unknown' if this process has no job
+    #   with the given key, or has forgotten it.
+    #
+    def status(self, key):
+        with self.lock:
+            result = self.jobs.get(key)
+        if result is None:
+            return 'unknown'
+        if not result.ready():
+            return 'pending'
+        return 'done' if result.successful() else 'failed'
+
+
+#   runner:
+#   This process's JobRunner, started the first time with the given number of workers and queue
+#   size.
+#
+def runner(workers=WORKERS, queueSize=QUEUE_SIZE):
+    with lock:
+        if not RUNNER:
+            RUNNER.append(JobRunner(workers, queueSize))
+        return RUNNER[0]
+
+
+#   status:
+#   The status of the job with the given key in this process (see JobRunner.status), without
+#   starting the pool if it hasn't been.
+#
+def status(key):
+    with lock:
+        current = RUNNER[0] if RUNNER else None
+    return current.status(key) if current else 'unknown'
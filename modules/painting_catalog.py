@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+
+#
+#   painting_catalog.py
+#
+#   Queries over the painting catalog for /controllers/paintings.py.  The gallery shows one page of
+#   paintings at a time, filtered by year and text, and the filters are SQL predicates, so the
+#   database only reads the paintings on the page rather than every painting in the catalog.
+#
+#   A painting belongs to a year if its start or end date falls in it.  Both filters become ranges
+#   on start_date and end_date, which are indexed (see /modules/db_indexes.py), and the pages are
+#   in the order of the (end_date, start_date) index, so the database stops reading once a page is
+#   full.
+#
+#   The text filter uses a full-text index where the database has one: an FTS5 table on SQLite, or
+#   a FULLTEXT index on MySQL.  Each word of the text matches words that start with it, and the
+#   results come best match first.  The FTS5 table keeps its own copy of the text fields, so the
+#   handlers that change a painting have to call syncPainting; a FULLTEXT index is part of the
+#   painting table and keeps itself up to date.  Without either, the text filter falls back to a
+#   substring match on each text field.
+#
+
+from datetime import date
+import re
+
+from sql_helpers import columnName, sqlTable
+
+
+#   paintings per page of the gallery
+PAGE_SIZE = 48
+
+#   the columns the text filter searches
+TEXT_FIELDS = ('title', 'description', 'location', 'medium')
+
+
+#   yearQuery:
+#   The paintings that started or ended in the given year.  Raises ValueError if it isn't a year
+#   a date can have.
+#
+def yearQuery(db, year):
+    painting = db.painting
+    first, after = date(year, 1, 1), date(year + 1, 1, 1)
+    return ((painting.start_date >= first) & (painting.start_date < after)) \
+        | ((painting.end_date >= first) & (painting.end_date < after))
+
+
+#   textQuery:
+#   The paintings with the given text, ignoring case, anywhere in one of the text fields.
+#
+def textQuery(db, text):
+    query = None
+    for field in TEXT_FIELDS:
+        match = db.painting[field].contains(text)
+        query = match if query is None else query | match
+    return query
+
+
+def galleryOrder(db):
+    return db.painting.end_date | db.painting.start_date | db.painting.id
+
+
+#   FULL-TEXT SEARCH
+
+#   the full-text search each database uses, by uri: 'fts5', 'fulltext' or None
+engines = {}
+
+#   uris of the databases whose search index this process has already made sure of
+ensured = set()
+
+
+def searchEngine(db):
+    if db._uri not in engines:
+        engine, name = db._adapter.dbengine, db._adapter.represent
+        if engine == 'sqlite':
+            sql = "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'painting_search'"
+        elif engine == 'mysql':
+            sql = "SELECT COUNT(*) FROM information_schema.statistics WHERE table_schema = DATABASE()" \
+                " AND table_name = %s AND index_name = 'painting_text'" % name(db.painting._tablename, 'string')
+        else:
+            engines[db._uri] = None
+            return None
+        found = db.executesql(sql)[0][0] > 0
+        engines[db._uri] = {'sqlite': 'fts5', 'mysql': 'fulltext'}[engine] if found else None
+    return engines[db._uri]
+
+
+def textColumns(db):
+    return ', '.join(columnName(db.painting[field]) for field in TEXT_FIELDS)
+
+
+#   ensureSearchIndex:
+#   Make the full-text index, and fill it with the paintings there are, the first time this process
+#   sees the given database, and commit.  If the database can't (eg. SQLite built without FTS5),
+#   the text filter falls back to substring matches.
+#
+def ensureSearchIndex(db):
+    if db._uri in ensured:
+        return
+    ensured.add(db._uri)
+    engine = db._adapter.dbengine
+    if engine not in ('sqlite', 'mysql') or searchEngine(db):
+        return
+    try:
+        if engine == 'sqlite':
+            db.executesql('CREATE VIRTUAL TABLE painting_search USING fts5(%s)' % ', '.join(TEXT_FIELDS))
+            db.executesql('INSERT INTO painting_search (rowid, %s) SELECT %s, %s FROM %s' % (
+                ', '.join(TEXT_FIELDS), columnName(db.painting.id), textColumns(db), sqlTable(db.painting)))
+        else:
+            db.executesql('CREATE FULLTEXT INDEX painting_text ON %s (%s)' % (
+                sqlTable(db.painting), textColumns(db)))
+        db.commit()
+    except Exception:
+        db.rollback()
+    engines.pop(db._uri, None)
+
+
+#   syncPainting:
+#   Bring the FTS5 table up to date with the painting of the given id, which may have been created,
+#   changed or deleted.  Call this wherever a painting changes; the caller commits.
+#
+def syncPainting(db, pid):
+    if searchEngine(db) != 'fts5':
+        return
+    pid = int(pid)
+    db.executesql('DELETE FROM painting_search WHERE rowid = %d' % pid)
+    db.executesql('INSERT INTO painting_search (rowid, %s) SELECT %s, %s FROM %s WHERE %s = %d' % (
+        ', '.join(TEXT_FIELDS), columnName(db.painting.id), textColumns(db), sqlTable(db.painting),
+        columnName(db.painting.id), pid))
+
+
+#   searchIds:
+#   The ids of the paintings, in the year if given, whose text fields have words starting with each
+#   word of the text, best match first, limited like a select.  None if there are no words in the
+#   text, or no full-text index to search.
+#
+def searchIds(db, text, year=None, limitby=None):
+    engine = searchEngine(db)
+    words = re.findall(r'\w+', text, re.UNICODE)
+    if not engine or not words:
+        return None
+    if engine == 'fts5':
+        terms = ' '.join('"%s"*' % word for word in words)
+        sql = 'SELECT rowid FROM painting_search WHERE painting_search MATCH %s' % (
+            db._adapter.represent(terms, 'string'))
+        if year is not None:
+            sql += ' AND rowid IN (%s)' % db(yearQuery(db, year))._select(db.painting.id).rstrip(';')
+        sql += ' ORDER BY rank'
+    else:
+        terms = ' '.join('+%s*' % word for word in words)
+        match = 'MATCH (%s) AGAINST (%s IN BOOLEAN MODE)' % (textColumns(db), db._adapter.represent(terms, 'string'))
+        sql = 'SELECT %s FROM %s WHERE %s' % (columnName(db.painting.id), sqlTable(db.painting), match)
+        if year is not None:
+            sql += ' AND %s' % yearQuery(db, year)
+        sql += ' ORDER BY %s DESC' % match
+    if limitby:
+        sql += ' LIMIT %d OFFSET %d' % (limitby[1] - limitby[0], limitby[0])
+    return [row[0] for row in db.executesql(sql)]
+
+
+#   findPaintings:
+#   One page of the paintings that match the given year and text, either of which may be None,
+#   with pages numbered from 1.  Returns the rows, and whether there are more pages after this one.
+#   With text to search for, they're in order of relevance if there's a full-text index, or else
+#   in the gallery's order like the rest.
+#
+def findPaintings(db, year=None, text=None, page=1, size=PAGE_SIZE):
+    start = (page - 1) * size
+    ids = searchIds(db, text, year, (start, start + size + 1)) if text else None
+    if ids is not None:
+        byId = dict((row.id, row) for row in db(db.painting.id.belongs(ids)).select()) if ids else {}
+        rows = [byId[pid] for pid in ids if pid in byId]
+        return rows[:size], len(rows) > size
+
+    query = db.painting.id > 0
+    if year is not None:
+        query &= yearQuery(db, year)
+    if text:
+        query &= textQuery(db, text)
+    rows = db(query).select(orderby=galleryOrder(db), limitby=(start, start + size + 1))
+    return rows[:size], len(rows) > size
+
+
+#   YEAR FACET
+#   The year menu and the year filter list the years that have paintings, with how many each has.
+#   Rather than work that out from every painting on every page, the painting_year table keeps the
+#   count for each year, and the handlers that change a painting call refreshYears with the years
+#   it had before and after.  The count of a year comes from the indexed yearQuery, so refreshing
+#   a year costs one index range however many paintings there are.
+
+#   uris of the databases whose year facet this process has already made sure of
+facetsEnsured = set()
+
+
+#   paintingYears:
+#   The years that have a painting, in order, found from the paintings themselves.
+#
+def paintingYears(db):
+    years = set()
+    for field in (db.painting.start_date, db.painting.end_date):
+        year = field.year()
+        for row in db(field != None).select(year, distinct=True):
+            years.add(int(row[year]))
+    return sorted(years)
+
+
+#   the years a painting (a row, or None) belongs to
+def recordYears(record):
+    if record is None:
+        return set()
+    return set(day.year for day in (record.start_date, record.end_date) if day is not None)
+
+
+#   refreshYears:
+#   Count the paintings of each of the given years again, and store the counts, dropping the years
+#   that have none left.  The caller commits.
+#
+def refreshYears(db, years):
+    for year in years:
+        try:
+            count = db(yearQuery(db, year)).count()
+        except ValueError:
+            continue
+        if count:
+            db.painting_year.update_or_insert(db.painting_year.year == year, year=year, paintings=count)
+        else:
+            db(db.painting_year.year == year).delete()
+
+
+#   ensureYearFacet:
+#   Fill the painting_year table from the paintings, if it's empty, the first time this process sees
+#   the given database, and commit.
+#
+def ensureYearFacet(db):
+    if db._uri in facetsEnsured:
+        return
+    facetsEnsured.add(db._uri)
+    if db(db.painting_year).isempty():
+        refreshYears(db, paintingYears(db))
+        db.commit()
+
+
+#   yearFacet:
+#   The years that have paintings, in order, each with how many, as (year, count).
+#
+def yearFacet(db):
+    rows = db(db.painting_year).select(db.painting_year.year, db.painting_year.paintings,
+        orderby=db.painting_year.year)
+    return [(row.year, row.paintings) for row in rows]
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+#
+#   painting_images.py
+#
+#   Smaller copies of the uploaded painting images, so the gallery doesn't download the full-size
+#   scan for every tile.  Each upload gets a JPEG copy at each of the WIDTHS below, made with Pillow
+#   the first time it's asked for and kept under static/paintings/thumbnails/<width>/, named after
+#   the upload.  The views list them in a srcset so the browser picks the smallest that fits, as
+#   static files where they've been made already; the paintings/image handler makes and serves the
+#   rest.
+#
+#   A new upload has its copies made straight away, in a worker process (see image_jobs.py), so they
+#   are usually there before anyone asks for them.
+#
+#   Without Pillow, the views just use the original upload.
+#
+
+import os
+import re
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+from gluon import URL, current
+
+import image_jobs
+
+
+#   the widths we make copies at, in pixels; copies are never larger than the original
+WIDTHS = (240, 480, 960, 1600)
+
+#   JPEG quality of the copies
+QUALITY = 85
+
+#   upload names as web2py makes them, eg. painting.image.8f3e....6a70672e6a7067.jpg
+UPLOAD_NAME = re.compile(r'^[\w.-]+$')
+
+
+def available():
+    return Image is not None
+
+
+def thumbnailFolder(appFolder, width):
+    return os.path.join(appFolder, 'static', 'paintings', 'thumbnails', str(width))
+
+
+def thumbnailPath(appFolder, name, width):
+    return os.path.join(thumbnailFolder(appFolder, width), name + '.jpg')
+
+
+#   the EXIF orientation of an image, or None
+def orientation(image):
+    try:
+        exif = image.getexif() if hasattr(image, 'getexif') else image._getexif()
+    except Exception:
+        return None
+    return exif.get(274) if exif else None
+
+
+#   makeThumbnail:
+#   Write the copy of the given image at the given width.  It's written to a temporary file first
+#   and renamed, so a request never sees half of one.
+#
+def makeThumbnail(source, path, width):
+    image = Image.open(source)
+    #   JPEGs can be decoded straight at a fraction of their size, which is much faster.  The draft
+    #   size is the copy's, in the orientation the image is stored in, before any EXIF rotation.
+    rotated = orientation(image) in (5, 6, 7, 8)
+    across, down = (image.height, image.width) if rotated else (image.width, image.height)
+    size = (width, max(1, down * width // across))
+    image.draft('RGB', size[::-1] if rotated else size)
+    if hasattr(ImageOps, 'exif_transpose'):
+        image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[-1])
+        image = background
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+    image.thumbnail((width, width * 10), Image.LANCZOS if hasattr(Image, 'LANCZOS') else Image.ANTIALIAS)
+
+    folder = os.path.dirname(path)
+    if not os.path.isdir(folder):
+        try:
+            os.makedirs(folder)
+        except OSError:
+            pass
+    temporary = '%s.%d.tmp' % (path, os.getpid())
+    image.save(temporary, 'JPEG', quality=QUALITY, optimize=True, progressive=True)
+    try:
+        os.rename(temporary, path)
+    except OSError:
+        #   Windows won't rename over a file, which means another request just made the same one
+        os.remove(temporary)
+
+
+#   thumbnail:
+#   The path of the copy of the given upload at the given width, made now if it doesn't exist yet,
+#   or None if there's no such upload or width.
+#
+def thumbnail(appFolder, uploadFolder, name, width):
+    try:
+        width = int(width)
+    except (TypeError, ValueError):
+        return None
+    if not available() or width not in WIDTHS or not name or not UPLOAD_NAME.match(name) or '..' in name:
+        return None
+    source = os.path.join(uploadFolder, name)
+    path = thumbnailPath(appFolder, name, width)
+    if not os.path.exists(path):
+        if not os.path.exists(source):
+            return None
+        makeThumbnail(source, path, width)
+    return path
+
+
+#   makeThumbnails:
+#   Make whichever copies of the given upload are missing.  This is the job queueThumbnails runs in
+#   a worker process.
+#
+def makeThumbnails(appFolder, uploadFolder, name):
+    for width in WIDTHS:
+        thumbnail(appFolder, uploadFolder, name, width)
+
+
+#   queueThumbnails:
+#   Have a worker process make the copies of a new upload, using a pool of the given size (or the
+#   defaults in image_jobs.py).  Returns False if they weren't queued (no Pillow, or the queue is
+#   full); they'll be made on request.
+#
+def queueThumbnails(appFolder, uploadFolder, name, workers=None, queueSize=None):
+    if not available():
+        return False
+    jobs = image_jobs.runner(int(workers or image_jobs.WORKERS), int(queueSize or image_jobs.QUEUE_SIZE))
+    return jobs.submit(name, makeThumbnails, appFolder, uploadFolder, name)
+
+
+#   where the copies of the given upload are: see image_jobs.status
+def thumbnailStatus(name):
+    return image_jobs.status(name)
+
+
+#   removeThumbnails:
+#   Delete the copies of an upload that's gone.
+#
+def removeThumbnails(appFolder, name):
+    for width in WIDTHS:
+        path = thumbnailPath(appFolder, name, width)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+#   imageURL:
+#   The URL of the given upload at the given width, for img src: the static file if the copy has
+#   been made, which the web server sends without running the app, or else the handler that makes
+#   it; the original if we can't make copies.
+#
+def imageURL(name, width):
+    if not available():
+        return URL('static', 'paintings/images/' + name)
+    if os.path.exists(thumbnailPath(current.request.folder, name, width)):
+        return URL('static', 'paintings/thumbnails/%d/%s.jpg' % (width, name))
+    return URL('paintings', 'image.jpg', args=[width, name])
+
+
+#   srcset:
+#   The srcset attribute listing the copies of the given upload, up to the given width; empty if
+#   we can't make copies.
+#
+def srcset(name, upTo=WIDTHS[-1]):
+    if not available():
+        return ''
+    return ', '.join('%s %dw' % (imageURL(name, width), width) for width in WIDTHS if width <= upTo)
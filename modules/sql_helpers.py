@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+
+#
+#   sql_helpers.py
+#
+#   Names of tables and columns as they go into SQL we write by hand, for the modules that build
+#   statements the DAL can't (multi-row inserts, recursive queries, indexes, full-text search).
+#   Newer versions of the DAL have these as sql_fullref and _rname, older ones as sqlsafe and
+#   sqlsafe_name.
+#
+
+
+def sqlTable(table):
+    return getattr(table, 'sql_fullref', None) or table.sqlsafe
+
+
+def columnName(field):
+    return getattr(field, '_rname', None) or field.sqlsafe_name
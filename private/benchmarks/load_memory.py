@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+#
+#   load_memory.py
+#
+#   Compares peak memory of building the whole load response and serializing it in one go (what
+#   response.json does) against streaming it with graph_load.streamGraph.  Needs Python 3 for
+#   tracemalloc:
+#
+#       python3 private/benchmarks/load_memory.py [number of parts]
+#
+
+import json
+import sys
+import time
+import tracemalloc
+
+from load_queries import DAL, buildGraph, defineTables, graph_index, graph_load
+
+
+def measure(name, produce):
+    tracemalloc.start()
+    start = time.time()
+    size = produce()
+    elapsed = time.time() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print('%-16s %8.1f MB peak %8.1f MB sent %8.2fs' % (name, peak / 1e6, size / 1e6, elapsed))
+
+
+def consume(chunks):
+    return sum(len(chunk) for chunk in chunks)
+
+
+def main():
+    numParts = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    db = DAL('sqlite:memory')
+    defineTables(db)
+    rootId = buildGraph(db, numParts)
+    index = graph_index.buildIndex(db)
+
+    measure('whole', lambda: len(json.dumps(graph_load.loadGraphRecursive(db, [rootId]))))
+    measure('stream', lambda: consume(graph_load.streamGraph(db, graph_load.iterReachableParts(db, [rootId]))))
+    measure('whole, index', lambda: len(json.dumps(index.load(db, [rootId]))))
+    measure('stream, index', lambda: consume(graph_load.streamGraph(db,
+        (index.record(pid) for pid in index.reachable([rootId])))))
+
+
+if __name__ == '__main__':
+    main()
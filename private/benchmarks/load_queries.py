@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+#
+#   load_queries.py
+#
+#   Counts the queries issued to load the whole concept graph, comparing the old part-at-a-time
+#   recursive loader with the engines in /modules/graph_load.py.  Runs against an in-memory SQLite
+#   database, so it needs nothing but pydal (which ships with web2py as gluon.dal):
+#
+#       python private/benchmarks/load_queries.py [number of parts]
+#
+#   The generated graph looks like a real knowledge base: a tree of nodes, each joined to its
+#   parent by an 'in' link, plus some cross links between random nodes.
+#
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'modules'))
+sys.setrecursionlimit(100000)
+
+try:
+    from pydal import DAL, Field
+except ImportError:
+    from gluon.dal import DAL, Field
+
+import graph_index
+import graph_load
+
+
+def defineTables(db):
+    db.define_table('concept',
+        Field('name', 'string'),
+        Field('description', 'string'),
+        Field('commands', 'string'),
+        Field('revision', 'integer', default=1))
+    db.define_table('part',
+        Field('concept', db.concept),
+        Field('start', 'reference part'),
+        Field('end', 'reference part'),
+        Field('revision', 'integer', default=1))
+    db.define_table('graph_version',
+        Field('version', 'integer'))
+    db.define_table('graph_change',
+        Field('version', 'integer'),
+        Field('table_name', 'string'),
+        Field('record_id', 'integer'),
+        Field('deleted', 'boolean', default=False))
+    db.define_table('graph_sequence',
+        Field('table_name', 'string', unique=True),
+        Field('next_id', 'integer'))
+
+
+def buildGraph(db, numParts, branching=8, seed=0):
+    random.seed(seed)
+    inId = db.concept.insert(name='in')
+    relatedId = db.concept.insert(name='related')
+    rootId = db.part.insert(concept=db.concept.insert(name='ROOT'))
+    nodes = [rootId]
+    count = 1
+    while count < numParts:
+        parent = nodes[(len(nodes) - 1) // branching]
+        node = db.part.insert(concept=db.concept.insert(name='node %d' % count))
+        db.part.insert(concept=inId, start=node, end=parent)
+        nodes.append(node)
+        count += 2
+        if count < numParts and random.random() < 0.2:
+            db.part.insert(concept=relatedId, start=node, end=random.choice(nodes))
+            count += 1
+    db.commit()
+    return rootId
+
+
+#   the loader that /controllers/default.py used before graph_load.py, kept here as the baseline
+def legacyLoad(db, rootId):
+
+    records = {'concept': {}, 'part': {}}
+
+    def loadPart(partId):
+        if partId in records['part']:
+            return
+        part = db.part(partId)
+        records['part'][partId] = part.as_dict()
+        loadConcept(part.concept)
+        if part.start is not None:
+            loadPart(part.start)
+        if part.end is not None:
+            loadPart(part.end)
+        for part in db((db.part.start == partId) | (db.part.end == partId)).select():
+            loadPart(part.id)
+
+    def loadConcept(conceptId):
+        if conceptId in records['concept']:
+            return
+        records['concept'][conceptId] = db.concept(conceptId).as_dict()
+
+    loadPart(rootId)
+    return records
+
+
+def countQueries(db, loader):
+    adapter = db._adapter
+    execute = adapter.execute
+    counter = [0]
+
+    def countingExecute(*args, **kwargs):
+        counter[0] += 1
+        return execute(*args, **kwargs)
+
+    adapter.execute = countingExecute
+    try:
+        start = time.time()
+        records = loader()
+        elapsed = time.time() - start
+    finally:
+        adapter.execute = execute
+    return records, counter[0], elapsed
+
+
+def run(name, db, loader, expected=None):
+    records, queries, elapsed = countQueries(db, loader)
+    print('%-12s %8d parts %8d concepts %8d queries %8.2fs' % (
+        name, len(records['part']), len(records['concept']), queries, elapsed))
+    if expected is not None and records != expected:
+        print('    MISMATCH against the legacy loader')
+    return records
+
+
+def main():
+    numParts = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    db = DAL('sqlite:memory')
+    defineTables(db)
+    rootId = buildGraph(db, numParts)
+
+    expected = run('legacy', db, lambda: legacyLoad(db, rootId))
+    run('bfs', db, lambda: graph_load.loadGraph(db, [rootId]), expected)
+    run('recursive', db, lambda: graph_load.loadGraphRecursive(db, [rootId]), expected)
+    index = graph_index.buildIndex(db)
+    run('index', db, lambda: index.load(db, [rootId]), expected)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+
+#
+#   model_startup.py
+#
+#   Times the per-request database setup that /models/db.py and /models/scheduler.py do before a
+#   handler like default/load runs, the old way and the way /modules/app_setup.py does it:
+#
+#       old: parse appconfig.ini and read static/misc.txt, open a new connection, define every
+#            table, and set up the scheduler, whose tables it defines too
+#       new: app_setup.settings and app_setup.connect - the config parsed once, a connection from
+#            the db_pool.py pool, lazy tables, of which a load uses two, and no scheduler
+#
+#   The new way runs the real app_setup and db_pool modules against a copy of the app's config in
+#   a temporary folder, with a SQLite database.  Outside of web2py, the parts of gluon they use are
+#   stood in for: the DAL is pydal's, AppConfig a ConfigParser that casts values the same way, and
+#   the scheduler's tables are defined as gluon.scheduler defines them.  The SQLite adapter never
+#   pools connections, so this lets it keep its pool size, to measure the pool as it would be on
+#   MySQL or Postgres.  The auth tables, which the JSON handlers no longer define at all, aren't
+#   included in either case, so the real difference is bigger.
+#
+#       python private/benchmarks/model_startup.py [number of requests]
+#
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+
+sys.path.insert(0, os.path.join(APP, 'modules'))
+
+try:
+    from ConfigParser import ConfigParser
+except ImportError:
+    from configparser import ConfigParser
+
+try:
+    from pydal import DAL, Field
+except ImportError:
+    from gluon.dal import DAL, Field
+
+
+#   AppConfig:
+#   What gluon.contrib.appconfig.AppConfig does with an .ini file: values by 'section.key', with
+#   numbers and booleans cast, and read again each time if reload is set.
+#
+class AppConfig(object):
+
+    def __init__(self, configfile=None, reload=False):
+        try:
+            config = ConfigParser(inline_comment_prefixes=(';',))
+        except TypeError:
+            config = ConfigParser()
+        config.read(configfile)
+        self.values = {}
+        for section in config.sections():
+            for key, value in config.items(section):
+                self.values[section + '.' + key] = value.strip()
+
+    def get(self, path, default=None):
+        value = self.values.get(path)
+        if value is None:
+            return default
+        if value.lower() in ('true', 'false'):
+            return value.lower() == 'true'
+        for cast in (int, float):
+            try:
+                return cast(value)
+            except ValueError:
+                pass
+        return value
+
+
+def readlines_file(filename, mode='r'):
+    with open(filename, mode) as f:
+        return f.read().split('\n')
+
+
+#   standInForGluon:
+#   Put the parts of gluon that app_setup and db_pool import in sys.modules, if there's no web2py
+#   to import them from.
+#
+def standInForGluon():
+    try:
+        import gluon.contrib.appconfig
+        import gluon.fileutils
+        return
+    except ImportError:
+        pass
+    gluon = types.ModuleType('gluon')
+    gluon.DAL, gluon.Field = DAL, Field
+    gluon.contrib = types.ModuleType('gluon.contrib')
+    gluon.contrib.appconfig = types.ModuleType('gluon.contrib.appconfig')
+    gluon.contrib.appconfig.AppConfig = AppConfig
+    gluon.fileutils = types.ModuleType('gluon.fileutils')
+    gluon.fileutils.readlines_file = readlines_file
+    for name, module in (('gluon', gluon), ('gluon.contrib', gluon.contrib),
+            ('gluon.contrib.appconfig', gluon.contrib.appconfig), ('gluon.fileutils', gluon.fileutils)):
+        sys.modules[name] = module
+
+
+#   poolSQLite:
+#   Have the SQLite adapter keep the pool size it's given, rather than setting it to 0.
+#
+def poolSQLite():
+    try:
+        from pydal.adapters.sqlite import SQLite
+    except ImportError:
+        print('this pydal has no SQLite._initialize_: the new requests are not pooled')
+        return
+    initialize = SQLite._initialize_
+
+    def keepPoolSize(self):
+        size = self.pool_size
+        initialize(self)
+        self.pool_size = size
+    SQLite._initialize_ = keepPoolSize
+
+
+standInForGluon()
+poolSQLite()
+
+try:
+    from pydal.connection import ConnectionPool
+except ImportError:
+    from pydal.adapters.base import BaseAdapter as ConnectionPool
+
+import app_setup
+
+
+class Storage(dict):
+    __getattr__ = dict.get
+
+
+def defineTables(db):
+    db.define_table('concept',
+        Field('name', 'string'),
+        Field('description', 'string'),
+        Field('commands', 'string'),
+        Field('revision', 'integer', default=1))
+    db.define_table('part',
+        Field('concept', db.concept),
+        Field('start', 'reference part'),
+        Field('end', 'reference part'),
+        Field('revision', 'integer', default=1))
+    db.define_table('graph_version',
+        Field('version', 'integer'))
+    db.define_table('graph_change',
+        Field('version', 'integer'),
+        Field('table_name', 'string'),
+        Field('record_id', 'integer'),
+        Field('deleted', 'boolean', default=False))
+    db.define_table('graph_sequence',
+        Field('table_name', 'string', unique=True),
+        Field('next_id', 'integer'))
+    db.define_table('save_request',
+        Field('request_key', 'string', length=128, unique=True),
+        Field('response', 'text'),
+        Field('created_on', 'datetime'))
+
+
+#   the tables gluon.scheduler.Scheduler defines when it's made
+def defineSchedulerTables(db):
+    db.define_table('scheduler_task',
+        Field('application_name'),
+        Field('task_name'),
+        Field('group_name', default='main'),
+        Field('status', default='QUEUED'),
+        Field('broadcast', 'boolean', default=False),
+        Field('function_name'),
+        Field('uuid', length=255, unique=True),
+        Field('args', 'text', default='[]'),
+        Field('vars', 'text', default='{}'),
+        Field('enabled', 'boolean', default=True),
+        Field('start_time', 'datetime'),
+        Field('next_run_time', 'datetime'),
+        Field('stop_time', 'datetime'),
+        Field('repeats', 'integer', default=1),
+        Field('retry_failed', 'integer', default=0),
+        Field('period', 'integer', default=60),
+        Field('prevent_drift', 'boolean', default=False),
+        Field('cronline'),
+        Field('timeout', 'integer', default=60),
+        Field('sync_output', 'integer', default=0),
+        Field('times_run', 'integer', default=0),
+        Field('times_failed', 'integer', default=0),
+        Field('last_run_time', 'datetime'),
+        Field('assigned_worker_name', default=''))
+    db.define_table('scheduler_run',
+        Field('task_id', 'reference scheduler_task'),
+        Field('status'),
+        Field('start_time', 'datetime'),
+        Field('stop_time', 'datetime'),
+        Field('run_output', 'text'),
+        Field('run_result', 'text'),
+        Field('traceback', 'text'),
+        Field('worker_name', default=''))
+    db.define_table('scheduler_worker',
+        Field('worker_name', length=255, unique=True),
+        Field('first_heartbeat', 'datetime'),
+        Field('last_heartbeat', 'datetime'),
+        Field('status'),
+        Field('is_ticker', 'boolean', default=False),
+        Field('group_names', 'list:string', default=['main']),
+        Field('worker_stats', 'json'))
+    db.define_table('scheduler_task_deps',
+        Field('job_name', default='job_0'),
+        Field('task_parent', 'integer'),
+        Field('task_child', 'reference scheduler_task'),
+        Field('can_visit', 'boolean', default=False))
+
+
+#   a load touches the graph version and the part table
+def handle(db):
+    db(db.graph_version).select(db.graph_version.version, limitby=(0, 1))
+    db(db.part.id == 1).select(db.part.ALL, limitby=(0, 1))
+
+
+#   what web2py does at the end of every request: commit, and give back or close the connections
+def endRequest():
+    ConnectionPool.close_all_instances('commit')
+
+
+def oldRequest(request):
+    config = AppConfig(configfile=os.path.join(request.folder, 'private', 'appconfig.ini'), reload=True)
+    prefix = readlines_file(os.path.join(request.folder, 'static', 'misc.txt'))[0].strip()
+    db = DAL(prefix + 'concept_graph', folder=os.path.join(request.folder, 'databases'),
+        migrate_enabled=config.get('db.migrate'))
+    defineTables(db)
+    defineSchedulerTables(db)
+    handle(db)
+    endRequest()
+
+
+def newRequest(request):
+    app_setup.settings(request.folder)
+    db = app_setup.connect(request, Storage())
+    defineTables(db)
+    handle(db)
+    endRequest()
+
+
+def loadRequest(folder):
+    return Storage(folder=folder, controller='default', function='load', extension='json')
+
+
+def run(name, handler, folder, count):
+    start = time.time()
+    for i in range(count):
+        handler(loadRequest(folder))
+    elapsed = time.time() - start
+    print('%-4s %6d requests   %7.3fms per request' % (name, count, 1000.0 * elapsed / count))
+
+
+#   appFolder:
+#   A temporary app folder with the app's config, a misc.txt pointing at a SQLite database in its
+#   databases folder, and the tables made.
+#
+def appFolder():
+    folder = tempfile.mkdtemp()
+    for name in ('private', 'static', 'databases'):
+        os.mkdir(os.path.join(folder, name))
+    shutil.copy(os.path.join(APP, 'private', 'appconfig.ini'), os.path.join(folder, 'private'))
+    with open(os.path.join(folder, 'static', 'misc.txt'), 'w') as f:
+        f.write('sqlite://\n')
+    DAL.set_folder(os.path.join(folder, 'databases'))
+    setup = DAL('sqlite://concept_graph', folder=os.path.join(folder, 'databases'))
+    defineTables(setup)
+    defineSchedulerTables(setup)
+    setup.commit()
+    setup.close()
+    return folder
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    folder = appFolder()
+    try:
+        #   the first request of each kind (creating the pool, parsing the config) is the cold start
+        for name, handler in (('old', oldRequest), ('new', newRequest)):
+            start = time.time()
+            handler(loadRequest(folder))
+            print('%-4s cold start           %7.3fms' % (name, 1000.0 * (time.time() - start)))
+            run(name, handler, folder, count)
+        import db_pool
+        print('pool: %s' % db_pool.poolStats()['concept_graph'])
+    finally:
+        shutil.rmtree(folder)
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+#
+#   query_plans.py
+#
+#   Checks that the queries the concept graph runs all the time - loading the graph, looking up
+#   concepts by name, the change log, expiring saved responses - use the indexes in
+#   /modules/db_indexes.py rather than scanning whole tables.  Builds a graph in an in-memory
+#   SQLite database, creates the indexes the way /cron/bootstrap.py does, and prints the plan
+#   SQLite picks for each query.  Exits with status 1 if any of them scans a table, so it can run
+#   as a check after changing a query or the indexes.  Reading a whole index counts as a scan too,
+#   eg. a search on 'start IS NOT NULL', which SQLite shows as a range with only a lower bound.
+#
+#   Two queries are allowed to scan, for the reasons given in ALLOWED_SCANS.  In particular the
+#   recursive query in /modules/graph_load.py reads every edge of the graph through the start and
+#   end indexes on each load, which grows with the graph; loads use the in-memory part index
+#   (/modules/graph_index.py) by default, and the recursive query only when asked for.
+#
+#
+#       python private/benchmarks/query_plans.py [number of parts]
+#
+
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'modules'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    from pydal import DAL, Field
+except ImportError:
+    from gluon.dal import DAL, Field
+
+import db_indexes
+import graph_load
+from load_queries import buildGraph, defineTables
+
+
+def queries(db, rootId):
+    ids = [rootId, rootId + 1, rootId + 2]
+    part, concept, change, saved = db.part, db.concept, db.graph_change, db.save_request
+    return (
+        ('reachable parts', graph_load.reachSQL(db, [rootId]) + 'SELECT id FROM reach'),
+        ('parts by endpoint', db(part.id.belongs(ids) | part.start.belongs(ids)
+            | part.end.belongs(ids))._select(part.ALL)),
+        ('parts of a concept', db(part.concept == rootId)._select(part.id, limitby=(0, 1))),
+        ('concept by name', db(concept.name == 'ROOT')._select(concept.id, limitby=(0, 1))),
+        ('changes since', db((change.version > 1) & (change.version <= 2))._select(change.ALL)),
+        ('expired saves', db(saved.created_on < '2000-01-01 00:00:00')._select(saved.id)),
+        ('save by key', db(saved.request_key == 'key')._select(saved.response)),
+    )
+
+
+#   the queries that may scan, and why
+ALLOWED_SCANS = {
+    'reachable parts': 'the recursive query lists every edge of the graph before following them',
+    'expired saves': 'reads only the saved responses past the cutoff, which it then deletes',
+}
+
+SEARCH = re.compile(r'^SEARCH (\w+) USING .*\((.*)\)$')
+
+
+#   openRange:
+#   Whether a line of a query plan searches a table's index with nothing but a one-sided range,
+#   eg. (start>?), which can read the whole index.
+#
+def openRange(db, line):
+    match = SEARCH.match(line)
+    if not match or match.group(1) not in db.tables:
+        return False
+    lower, upper = set(), set()
+    for term in match.group(2).split(' AND '):
+        column = re.match(r'\w+', term).group(0)
+        if '>' in term:
+            lower.add(column)
+        elif '<' in term:
+            upper.add(column)
+        else:
+            return False
+    return not (lower & upper)
+
+
+#   scans:
+#   The lines of a query plan that read a whole table or index of one.  Scanning the intermediate
+#   results of a query (eg. the 'reach' CTE) is fine.
+#
+def scans(db, plan):
+    return [line for line in plan if (line.startswith('SCAN ') and line.split()[1] in db.tables)
+        or openRange(db, line)]
+
+
+def main():
+    numParts = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    db = DAL('sqlite:memory')
+    defineTables(db)
+    db.define_table('save_request',
+        Field('request_key', 'string', length=128, unique=True),
+        Field('response', 'text'),
+        Field('created_on', 'datetime'))
+    rootId = buildGraph(db, numParts)
+    print('created indexes: %s' % ', '.join(db_indexes.ensureIndexes(db)))
+    db.executesql('ANALYZE')
+
+    failed = []
+    allowed = []
+    for name, sql in queries(db, rootId):
+        plan = [row[-1] for row in db.executesql('EXPLAIN QUERY PLAN ' + sql)]
+        print('\n%s\n    %s' % (name, '\n    '.join(plan)))
+        if scans(db, plan):
+            (allowed if name in ALLOWED_SCANS else failed).append(name)
+
+    for name in allowed:
+        print('\nallowed scan in %s: %s' % (name, ALLOWED_SCANS[name]))
+    if failed:
+        print('\nFULL SCANS: %s' % ', '.join(failed))
+        sys.exit(1)
+    print('\nno other full scans')
+
+
+if __name__ == '__main__':
+    main()
@@ -108,27 +108,123 @@
 
 
 
+        /*
+            The full load is a GET, so the browser can keep the response and just check with the server
+            whether the graph has changed since (via its ETag).
+        */
         Page.load = function(callback) {
+            $.ajax({
+                url: Page.loadURL,
+                type: 'get',
+                dataType: 'json',
+                data: Page.format ? {format: Page.format} : {},
+                success: function(data) {
+                    Page.version = data.version;
+                    Page.store(data, true);
+                    if(typeof callback === 'function') callback.call(Page, data);
+                }
+            });
+        };
+
+        /*
+            Pull in whatever other users have saved since our last load or refresh.  The server only sends
+            the concepts and parts that changed since Page.version, with deleted ones flagged as such.
+        */
+        Page.refresh = function(callback) {
+            if(Page.version === undefined) return Page.load(callback);
+            Page.refreshing = true;
             $.ajax({
                 url: Page.loadURL,
                 type: 'post',
                 dataType: 'json',
-                data: JSON.stringify({all: true}),
+                data: JSON.stringify({since: Page.version, format: Page.format}),
                 success: function(data) {
-                    Page.store(data);
+                    Page.version = data.version;
+                    Page.store(data, true);
                     if(typeof callback === 'function') callback.call(Page, data);
+                },
+                complete: function() {
+                    Page.refreshing = false;
                 }
             });
         };
 
+        /*
+            Refresh whenever the window gets the focus back, and every Page.refreshInterval milliseconds while
+            it's showing - but not while a save or another refresh is still going.
+        */
+        Page.autoRefresh = function() {
+            let refresh = function() {
+                if(Page.saving || Page.refreshing || document.hidden) return;
+                Page.refresh();
+            };
+            $(window).on('focus', refresh);
+            if(Page.refreshInterval) setInterval(refresh, Page.refreshInterval);
+        };
+
+        /*
+            Load just the part of the graph around the given root part - options can include 'depth' (in hops)
+            and 'limit' (roughly how many parts to load).  The response includes a 'frontier' of part ids
+            whose neighbors weren't loaded, and a 'cursor' which can be passed back as an option to continue.
+            The first load we do gives us the version that later refreshes pull changes since.
+
+            Page.frontier has the ids of the parts we have but haven't loaded all the neighbors of, so we know
+            to load the neighborhood of one before showing it (see Explorer.prototype.open).
+
+            Like the full load, a neighborhood load is a GET the browser can keep, unless it's continuing from
+            a cursor.
+        */
+        Page.frontier = {};
+
+        Page.loadNeighborhood = function(root, options, callback) {
+            let data = $.extend({root: root}, Page.format ? {format: Page.format} : {}, options),
+                cursor = options && options.cursor;
+            $.ajax({
+                url: Page.loadURL,
+                type: cursor ? 'post' : 'get',
+                dataType: 'json',
+                data: cursor ? JSON.stringify(data) : data,
+                success: function(data) {
+                    if(Page.version === undefined) Page.version = data.version;
+                    let loaded = Array.isArray(data.part) ? Table.fromColumns(data.part) : data.part;
+                    for(let id in loaded) delete Page.frontier[id];
+                    (data.frontier || []).forEach(function(id) {
+                        Page.frontier[id] = true;
+                    });
+                    Page.store(data, true);
+                    if(typeof callback === 'function') callback.call(Page, data);
+                }
+            });
+        };
+
+        /*
+            Only send what changed since the last save: new records, records whose fields were set (see
+            Record.prototype.set), and deleted records.  References to records we don't send are just their
+            ids, which the server takes as records it already has.  If the save fails, the records we sent
+            are marked dirty again so the next save retries them.
+
+            Along with each existing record we send the revision we have of it.  If someone else has saved
+            any of those records since, the server saves nothing and responds 409 with its current version of
+            just those records.  We take those as they are, dropping our changes to them - records we deleted
+            are restored - and the rest of our changes go out with the next save.
+
+            A save of more than Page.backgroundSaveSize records is done by a background job on the server,
+            which we poll until it's done (see Page.waitForSave).  New records are sent every time until they're
+            saved, so we don't start another save while one is still going.
+
+            If we don't hear back from the server, we send the same save again, up to Page.saveRetries times.
+            Each save has a random idempotency key, so if the server did get it the first time, it just sends
+            us the same response again instead of saving twice.
+        */
         Page.save = function() {
-            let records = {concept: {}, part: {}};
+            if(Page.saving) return;
+            let records = {concept: {}, part: {}}, sent = [];
             Page.eachTable(function(table, name) {
                 table.each(function(record, id) {
                     if(record.deleted) {
-                        if(id > 0) records[name][id] = { id: id, deleted: true };
+                        if(id > 0) records[name][id] = { id: id, deleted: true, revision: record.revision };
                         else table.delete(id);
-                    } else {
+                    } else if(id < 0 || record.dirty) {
                         if(record instanceof Concept) {
                             records.concept[id] = {
                                 name: record.name || '',
@@ -142,17 +238,104 @@
                                 end: record.getEndId()
                             };
                         }
-                        if(id > 0) records[name][id].id = id;
+                        if(id > 0) {
+                            records[name][id].id = id;
+                            records[name][id].revision = record.revision;
+                        }
+                        record.dirty = false;
+                        sent.push(record);
                     }
                 }, true);
             });
+            if(Object.keys(records.concept).length === 0 && Object.keys(records.part).length === 0) return;
+            Page.saving = true;
+            let background = Page.backgroundSaveSize !== undefined && sent.length > Page.backgroundSaveSize;
+            if(Page.format === 'columnar') {
+                for(let name in records) records[name] = Table.toColumns(records[name]);
+            }
+            let key = Date.now().toString(36) + Math.random().toString(36).slice(2),
+                body = JSON.stringify({records: records, format: Page.format, async: background});
+            let send = function(attempt) {
+                $.ajax({
+                    url: Page.saveURL,
+                    type: 'post',
+                    dataType: 'json',
+                    headers: {'Idempotency-Key': key},
+                    data: body,
+                    success: function(data) {
+                        if(background) Page.waitForSave(data.job, sent);
+                        else Page.saved(data);
+                    },
+                    error: function(xhr) {
+                        let noResponse = xhr.status === 0 || xhr.status === 502 || xhr.status === 503 || xhr.status === 504;
+                        if(noResponse && attempt < (Page.saveRetries || 0)) {
+                            setTimeout(function() {
+                                send(attempt + 1);
+                            }, 1000 * Math.pow(2, attempt));
+                        } else {
+                            Page.saveFailed(sent, xhr.status === 409 ? JSON.parse(xhr.responseText) : null);
+                        }
+                    }
+                });
+            };
+            send(0);
+        };
+
+        /*
+            The response has the version our save made.  If it's the one right after ours, nobody else saved
+            in between and we're up to date; otherwise the next refresh pulls in what they saved, along with
+            our own save.
+        */
+        Page.saved = function(data) {
+            Page.saving = false;
+            if(data.version !== undefined && data.version === Page.version + 1) Page.version = data.version;
+            Page.store(data);
+        };
+
+        Page.saveFailed = function(sent, conflicts) {
+            Page.saving = false;
+            sent.forEach(function(record) {
+                record.dirty = true;
+            });
+            if(conflicts) {
+                Page.eachTable(function(table, name) {
+                    for(let id in conflicts[name]) {
+                        let record = table.records[id];
+                        if(!record) continue;
+                        record.dirty = false;
+                        if(record.deleted && !conflicts[name][id].deleted) record.restore();
+                    }
+                });
+                Page.store(conflicts);
+            }
+        };
+
+        /*
+            Check on a background save every Page.saveStatusInterval milliseconds until it's done.  The job's
+            result is the same as a direct save's response, or if it couldn't be done, an 'error' message or
+            the 'conflicts'.
+        */
+        Page.waitForSave = function(job, sent) {
             $.ajax({
-                url: Page.saveURL,
-                type: 'post',
+                url: Page.saveStatusURL,
+                type: 'get',
                 dataType: 'json',
-                data: JSON.stringify({records: records}),
+                data: {job: job},
                 success: function(data) {
-                    Page.store(data);
+                    if(data.status === 'COMPLETED') {
+                        if(data.result.error || data.result.conflicts) Page.saveFailed(sent, data.result.conflicts);
+                        else Page.saved(data.result);
+                    } else if(data.status === 'FAILED' || data.status === 'TIMEOUT' || data.status === 'STOPPED') {
+                        Page.saveFailed(sent);
+                    } else {
+                        if(data.progress) console.log('saving: ' + data.progress);
+                        setTimeout(function() {
+                            Page.waitForSave(job, sent);
+                        }, Page.saveStatusInterval || 1000);
+                    }
+                },
+                error: function() {
+                    Page.saveFailed(sent);
                 }
             });
         };
@@ -165,14 +348,32 @@
             return true;
         };
 
-        Page.store = function(data) {
-            Concept.table.store(data.concept);
-            Part.table.store(data.part);
+        /*
+            Records coming from the server aren't changes of ours, so they don't get marked dirty.  With keepEdits
+            (for loads and refreshes, as opposed to the responses to our saves), records we've changed or deleted
+            and not saved yet are left as they are, and reported to Page.editConflict.  We still have the revision
+            we started from, so if someone else's change really does clash with ours, our next save gets a 409.
+        */
+        Page.store = function(data, keepEdits) {
+            Page.storing = true;
+            try {
+                Concept.table.store(data.concept, keepEdits);
+                Part.table.store(data.part, keepEdits);
+            } finally {
+                Page.storing = false;
+            }
             Part.updateReferences();
             Concept.table.removeOldIds();
             Part.table.removeOldIds();
         };
 
+        /*
+            Someone else saved a record we're in the middle of changing or deleting.
+        */
+        Page.editConflict = function(record, incoming) {
+            console.log('changed by someone else since we started editing: ' + record.toString());
+        };
+
 
         function Table(type) {
             this.type = type;
@@ -211,22 +412,78 @@
             return record;
         };
 
-        Table.prototype.store = function(records) {
+        /*
+            The 'columnar' wire format sends each table as a list of blocks, each with one array per field
+            rather than one object per record - see /modules/graph_format.py.  A null in one of the flag
+            columns means the record doesn't have that flag, and a 'key' column, if present, says which
+            id each record is filed under (new records don't have an id yet).
+        */
+        Table.flagKeys = ['id', 'deleted', 'oldId'];
+
+        Table.fromColumns = function(blocks) {
+            let records = {};
+            blocks.forEach(function(block) {
+                let keys = block.key || block.id, fields = Object.keys(block).filter(function(field) {
+                    return field !== 'key';
+                });
+                keys.forEach(function(key, i) {
+                    let record = {};
+                    fields.forEach(function(field) {
+                        let value = block[field][i];
+                        if(value !== null || Table.flagKeys.indexOf(field) < 0) record[field] = value;
+                    });
+                    records[key] = record;
+                });
+            });
+            return records;
+        };
+
+        Table.toColumns = function(records) {
+            let block = {key: []}, count = 0;
+            for(let key in records) {
+                let record = records[key];
+                for(let field in record) {
+                    if(!block[field]) block[field] = new Array(count).fill(null);
+                }
+                for(let field in block) {
+                    if(field === 'key') block.key.push(key);
+                    else block[field].push(record[field] === undefined ? null : record[field]);
+                }
+                count++;
+            }
+            return count > 0 ? [block] : [];
+        };
+
+        Table.prototype.store = function(records, keepEdits) {
+            if(Array.isArray(records)) records = Table.fromColumns(records);
             records.stored = {};
-            for(let id in records) {
-                if(id === 'stored') continue;
-                this.storeRecord(records, id);
+            this.keepEdits = keepEdits;
+            try {
+                for(let id in records) {
+                    if(id === 'stored') continue;
+                    this.storeRecord(records, id);
+                }
+            } finally {
+                this.keepEdits = false;
             }
         };
 
         Table.prototype.storeRecord = function(records, id) {
             let record = records[id];
+            // a reference to a record that isn't in this batch - we should already have it
+            if(!record) return;
             id = parseInt(id);
             record.id = parseInt(record.id);
 
             if(records.stored[id]) return;
             records.stored[id] = true;
 
+            let local = this.records[id];
+            if(this.keepEdits && local && (local.dirty || local.deleted)) {
+                Page.editConflict(local, record);
+                return;
+            }
+
             if(record.deleted) {
                 delete this.records[id];
                 return;
@@ -289,6 +546,11 @@
 
         Record.prototype.set = function(key, value) {
             this[key] = value;
+            this.markDirty();
+        };
+
+        Record.prototype.markDirty = function() {
+            if(!Page.storing) this.dirty = true;
         };
 
         Record.prototype.each = function(field, callback) {
@@ -318,6 +580,16 @@
             this.updatePage();
         };
 
+        /*
+            Undo a delete that the server turned down.
+        */
+        Record.prototype.restore = function() {
+            if(!this.deleted) return;
+            delete this.deleted;
+            this.dirty = false;
+            this.updatePage();
+        };
+
 
         function Concept() {
             Record.prototype.constructor.call(this);
@@ -513,11 +785,38 @@
             }
         };
 
+        /*
+            Undoing a delete brings back what deleting the part took with it: its concept, its start and end,
+            and its links to parts that are still here.
+        */
+        Part.prototype.restore = function() {
+            let self = this;
+            if(!self.deleted) return;
+            delete self.deleted;
+            self.dirty = false;
+            if(self.concept) self.concept.restore();
+            if(self.start) {
+                self.start.restore();
+                self.setNeighbor(self.start, 'incoming');
+            }
+            if(self.end) {
+                self.end.restore();
+                self.setNeighbor(self.end, 'outgoing');
+            }
+            Part.table.each(function(link) {
+                if(!link.deleted || (link.start !== self && link.end !== self)) return;
+                let other = link.start === self ? link.end : link.start;
+                if(!other || !other.deleted) link.restore();
+            }, true);
+            self.updatePage();
+        };
+
         Part.prototype.getConcept = function() {
             return this.concept;
         };
         Part.prototype.setConcept = function(concept) {
             this.concept = concept;
+            this.markDirty();
             if(!this.isLink()) concept.setNode(this);
         };
         Part.prototype.getConceptId = function() {
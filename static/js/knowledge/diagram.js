@@ -252,6 +252,16 @@
         };
 
         Explorer.prototype.open = function(node, mode) {
+            let self = this;
+            // if we haven't loaded this part or all of its neighbors yet, page in its neighborhood first
+            if((!Part.get(node) || Page.frontier[node]) && !isNaN(node) && node > 0 && !self.loadingNode) {
+                self.loadingNode = true;
+                Page.loadNeighborhood(node, {depth: Page.neighborhoodDepth}, function() {
+                    self.loadingNode = false;
+                    self.open(node, mode);
+                });
+                return;
+            }
             this.$partEdit.hide();
             this.node = Part.get(node);
             let preferredMode = (this.node && this.node.hasLink(Concept.isA, 'law')) ? 'graph' : this.mode;